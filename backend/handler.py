@@ -16,6 +16,7 @@ from typing import Tuple, Optional
 
 import boto3
 from botocore.exceptions import ClientError
+import orjson
 import os
 import sys
 import logging
@@ -93,10 +94,11 @@ def _transcription_exists(bucket: str, key: str) -> bool:
             return False
         raise
 
-def _start_transcribe_job(bucket: str, key: str) -> str:
+def _start_transcribe_job(bucket: str, key: str) -> Tuple[str, str]:
     """
     מפעיל Job חדש ב־Transcribe עבור קובץ שמע.
     שומר את התמלול תמיד תחת transcriptions/<base_name>.json
+    מחזיר (job_name, out_key) – כך שאין צורך לפרק את TranscriptFileUri אחרי הסיום.
     """
     job_name = f"gemini-transcribe-{uuid.uuid4()}"  # שם ייחודי ל־Job
     media_uri = f"s3://{bucket}/{key}"
@@ -113,15 +115,15 @@ def _start_transcribe_job(bucket: str, key: str) -> str:
         OutputBucketName=INPUT_BUCKET_NAME,
         OutputKey=out_key
     )
-    return job_name
+    return job_name, out_key
 
 def _wait_for_transcribe(job_name: str, timeout_sec: int = 600, poll_sec: int = 5) -> Optional[dict]:
     """
     Poll Transcribe job status until completion or timeout.
     Returns the job dict if completed successfully, else None.
     """
-    start = time.time()
-    while time.time() - start < timeout_sec:
+    deadline = time.monotonic() + timeout_sec
+    while time.monotonic() < deadline:
         resp = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
         job = resp["TranscriptionJob"]
         status = job["TranscriptionJobStatus"]
@@ -133,32 +135,18 @@ def _wait_for_transcribe(job_name: str, timeout_sec: int = 600, poll_sec: int =
     return None
 
 
-def _read_transcript_from_s3(transcript_uri: str) -> str:
+def _read_transcript_by_key(bucket: str, key: str) -> str:
     """
-    Transcribe provides a HTTPS URL to the transcript JSON.
-    For security and determinism, we prefer reading the JSON from S3
-    (the same bucket configured as OutputBucketName).
+    Read the transcript JSON from the OutputBucketName/OutputKey the job was started with.
     """
-    # TranscriptUri looks like: https://s3.<region>.amazonaws.com/<bucket>/<key>
-    # Extract bucket and key by basic parsing:
-    # Alternatively, if OutputBucketName is the same as INPUT_BUCKET_NAME,
-    # Transcribe writes a JSON object named {job_name}.json at the root.
-    # We will detect that path from the URI.
-    parsed = urllib.parse.urlparse(transcript_uri)
-    path = parsed.path.lstrip("/")  # "<bucket>/<key>"
-    parts = path.split("/", 1)
-    if len(parts) != 2:
-        raise ValueError(f"Unexpected transcript URI format: {transcript_uri}")
-    bucket, key = parts[0], parts[1]
-
     obj = s3_client.get_object(Bucket=bucket, Key=key)
-    data = obj["Body"].read().decode("utf-8")
-    payload = json.loads(data)
+    # orjson מפרסר ישירות מ-bytes, בלי decode
+    payload = orjson.loads(obj["Body"].read())
     # Transcript JSON schema: {"results": {"transcripts": [{"transcript": "..."}]}}
-    transcripts = payload.get("results", {}).get("transcripts", [])
-    if not transcripts:
+    try:
+        return payload["results"]["transcripts"][0].get("transcript", "")
+    except (KeyError, IndexError):
         return ""
-    return transcripts[0].get("transcript", "")
 
 
 def _gemini_summarize_and_answer(text: str, question: str = "") -> dict:
@@ -366,11 +354,10 @@ def _write_summary_to_s3(original_key: str, summary: dict):
     """
     base_name = original_key.split("/")[-1]
     out_key = f"{OUTPUT_PREFIX}{base_name}.summary.json"
-    body = json.dumps(summary, ensure_ascii=False, indent=2)
     s3_client.put_object(
         Bucket=INPUT_BUCKET_NAME,
         Key=out_key,
-        Body=body.encode("utf-8"),
+        Body=orjson.dumps(summary, option=orjson.OPT_INDENT_2),
         ContentType="application/json",
     )
     return out_key
@@ -428,7 +415,7 @@ def agent_handler(event, context):
             obj = s3_client.get_object(Bucket=bucket, Key=transcript_key)
             transcript_text = obj["Body"].read().decode("utf-8")
         else:
-            job_name = _start_transcribe_job(bucket, key)
+            job_name, out_key = _start_transcribe_job(bucket, key)
             log.info("Transcribe job started: %s for s3://%s/%s", job_name, bucket, key)
 
             job = _wait_for_transcribe(job_name)
@@ -439,8 +426,7 @@ def agent_handler(event, context):
                     "body": json.dumps("Transcribe timed out")
                 }
 
-            transcript_uri = job["Transcript"]["TranscriptFileUri"]
-            transcript_text = _read_transcript_from_s3(transcript_uri)
+            transcript_text = _read_transcript_by_key(INPUT_BUCKET_NAME, out_key)
 
         if not transcript_text.strip():
             return {
@@ -1,13 +1,14 @@
 # handler2_0.py
 # Serverless Voice Agent with audio splitting, noise reduction, parallel transcription, and merge
 
-import os, json, uuid, time, urllib.parse, logging, re
+import os, io, json, uuid, time, urllib.parse, logging, re, subprocess, hashlib, threading, mmap
 from typing import Tuple, Optional, List
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from google import genai
-import math
-from pydub import AudioSegment, effects
+import ijson
+import orjson
 
 
 import concurrent.futures
@@ -15,7 +16,8 @@ os.environ["PATH"] += ":/opt/bin"
 
 
 log = logging.getLogger()
-log.setLevel(logging.DEBUG)
+# לוגים פר-chunk ו-dump של ה-event ברמת DEBUG; ניתן להפעיל עם LOG_LEVEL=DEBUG
+log.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
 
 
 # --- Environment variables ---
@@ -25,10 +27,39 @@ GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
 GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.5-flash")
 TRANSCRIBE_REGION = os.environ.get("TRANSCRIBE_REGION", "us-east-1")
 TRANSCRIBE_LANGUAGE = os.environ.get("TRANSCRIBE_LANGUAGE", "he-IL")  # עברית
-
-session = boto3.session.Session()
-s3_client = session.client("s3", region_name="us-east-1")
-transcribe_client = session.client("transcribe", region_name=TRANSCRIBE_REGION)
+# פיצול לקטעים ותמלול מקבילי – כבוי כברירת מחדל; Transcribe מקבל עד 4 שעות בקובץ אחד
+CHUNKED_TRANSCRIBE = os.environ.get("CHUNKED_TRANSCRIBE", "false").strip().lower() in ("1", "true", "yes")
+CHUNK_LENGTH_MS = 60000
+TRANSCRIBE_MAX_DURATION_MS = 4 * 60 * 60 * 1000
+TRANSCRIBE_SAMPLE_RATE = 16000  # קצב הדגימה שבו מודל Transcribe עובד בפועל
+# מגבלת קריאות StartTranscriptionJob בו-זמניות (מכסת ה-API של Transcribe)
+_TRANSCRIBE_SUBMIT_SLOTS = threading.BoundedSemaphore(5)
+
+# max_pool_connections מעל ברירת המחדל (10) – ההעלאות, שליחת ה-jobs וההמתנה רצים במקביל
+_BOTO_CONFIG = Config(retries={"max_attempts": 3, "mode": "adaptive"}, tcp_keepalive=True, max_pool_connections=32)
+s3_client = boto3.client("s3", region_name="us-east-1", config=_BOTO_CONFIG)
+transcribe_client = boto3.client("transcribe", region_name=TRANSCRIBE_REGION, config=_BOTO_CONFIG)
+# העלאה/הורדה מקבילית ב-multipart לקבצים גדולים (הקובץ המקורי יכול להגיע למאות MB)
+_TRANSFER_CFG = TransferConfig(multipart_threshold=8 * 1024 * 1024, max_concurrency=8, use_threads=True)
+
+# לקוח Gemini נוצר פעם אחת לכל container (import ו-TLS רק בקריאה הראשונה)
+_gemini_client = None
+
+def _get_gemini_client():
+    global _gemini_client
+    if _gemini_client is None:
+        import httpx
+        from google import genai
+        from google.genai import types
+        # חיבור HTTP אחד שנשמר בין הפעלות "חמות" – בלי TLS handshake חדש לכל סיכום
+        http_client = httpx.Client(
+            timeout=httpx.Timeout(300.0, connect=10.0),
+            limits=httpx.Limits(max_keepalive_connections=4),
+            transport=httpx.HTTPTransport(retries=2),
+        )
+        _gemini_client = genai.Client(api_key=GEMINI_API_KEY,
+                                      http_options=types.HttpOptions(httpx_client=http_client))
+    return _gemini_client
 
 
 # --- Utilities ---
@@ -38,224 +69,82 @@ def _parse_s3_event(event) -> Tuple[str, str]:
     key = urllib.parse.unquote_plus(record["s3"]["object"]["key"])
     return bucket, key
 
-def split_audio(local_path: str, chunk_length_ms: int = 60000) -> list:
-    """פיצול קובץ אודיו לקטעים של עד 2 דקות"""
-    audio = AudioSegment.from_file(local_path)
-    if len(audio) <= chunk_length_ms:
-        out_path = f"/tmp/chunk_0.wav"
-        audio.export(out_path, format="wav")
-        log.info("קובץ קצר – נשמר כיחידה אחת באורך %dms", len(audio))
-        return [out_path]
-
-    chunks = []
-    for i in range(0, len(audio), chunk_length_ms):
-        chunk = audio[i:i+chunk_length_ms]
-        out_path = f"/tmp/chunk_{i//chunk_length_ms}.wav"
-        chunk.export(out_path, format="wav")
-        chunks.append(out_path)
-        log.info("נוצר chunk %d באורך %dms", i//chunk_length_ms, len(chunk))
-    return chunks
-
-def _infer_media_format(key: str) -> str:
-    ext = key.split(".")[-1].lower()
-    return {"wav":"wav","mp3":"mp3","flac":"flac","ogg":"ogg","mp4":"mp4","m4a":"mp4"}.get(ext, ext)
-
-# --- Gemini summarizer ---
+def _probe_duration_ms(local_path: str) -> Optional[int]:
     """
-    Request a structured summary from Gemini and return sections with titles and bullets.
-    Returns: { "sections": [ {"title": str, "bullets": [str, ...]}, ... ], "raw": str }
+    Read the audio duration from the container header with ffprobe (no full decode).
+    Returns None if the duration could not be determined.
     """
-    client = genai.Client(api_key=GEMINI_API_KEY)
-
-    # Prompt: ask for structured JSON output with sections and bullets in Hebrew.
-    prompt = (
-        "אתה מקבל תמליל של אינטראקציה אנושית: פגישה, שיעור, הרצאה או שיחת טלפון.\n"
-        "אנא הפק תקציר מובנה בפורמט JSON בלבד.\n"
-        "ה‑JSON חייב להיות אובייקט עם המפתחות הבאים:\n"
-        "- sections: רשימה של אובייקטים, כל אחד עם 'title' בעברית ו‑'bullets' (מערך נקודות בעברית).\n"
-        "- participants: רשימת שמות או תפקידים אם מופיעים בתמליל. אם לא מופיעים שמות, השתמש ב'דובר א', 'דובר ב'.\n"
-        "- decisions: החלטות או הסכמות שהתקבלו.\n"
-        "- action_items: משימות להמשך או פעולות שסוכמו.\n"
-        "- questions: שאלות שעלו.\n\n"
-        "הוראות מותאמות לפי סוג התמליל:\n"
-        "- אם מדובר בשיחת טלפון: התמקד בזיהוי הדוברים, בהסכמות קצרות, בשאלות ישירות ובמשימות פשוטות.\n"
-        "- אם מדובר בפגישה: התמקד בזיהוי משתתפים, נושאים מרכזיים, החלטות רשמיות ומשימות להמשך.\n"
-        "- אם מדובר בהרצאה או שיעור: התמקד בנושאים שהוסברו, דוגמאות שהובאו, שאלות תלמידים/קהל, והמלצות להמשך לימוד.\n"
-        "- אם לא ניתן לזהות את סוג התמליל: הפק סיכום כללי לפי המבנה הנדרש.\n\n"
-        "אל תוסיף טקסט נוסף מחוץ ל‑JSON.\n"
-        "דוגמה:\n"
-        '{\n'
-        '  "sections": [\n'
-        '    { "title": "נושא א", "bullets": ["נקודה1","נקודה2"] },\n'
-        '    { "title": "נושא ב", "bullets": ["נקודה1"] }\n'
-        '  ],\n'
-        '  "participants": ["דובר א","דובר ב"],\n'
-        '  "decisions": ["הוסכם להיפגש ביום ראשון"],\n'
-        '  "action_items": ["דובר א ישלח מסמך","דובר ב יבדוק זמינות"],\n'
-        '  "questions": ["מתי הפגישה הבאה?"]\n'
-        '}\n\n'
-        "תמליל:\n"
-        f"{text}\n"
-    )
-
-    # Call the SDK using the correct parameter name 'contents'.
-    result = client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=prompt,
-        config={"temperature": 0.0}
-    )
-
-    # Extract raw text from the SDK response using common response shapes.
-    def _extract_raw_text(res):
-        if hasattr(res, "output_text"):
-            try:
-                t = getattr(res, "output_text")
-                if t:
-                    return t
-            except Exception:
-                pass
-        out = getattr(res, "output", None)
-        if out:
-            try:
-                first = out[0]
-                if hasattr(first, "content"):
-                    c = first.content
-                    if isinstance(c, (list, tuple)) and len(c) > 0:
-                        texts = []
-                        for part in c:
-                            if hasattr(part, "text"):
-                                texts.append(getattr(part, "text") or "")
-                            elif isinstance(part, dict) and "text" in part:
-                                texts.append(part["text"] or "")
-                        joined = "\n".join([t for t in texts if t])
-                        if joined:
-                            return joined
-                if hasattr(first, "text"):
-                    return getattr(first, "text") or ""
-                if isinstance(first, dict) and "text" in first:
-                    return first["text"] or ""
-            except Exception:
-                pass
-        try:
-            return str(res)
-        except Exception:
-            return ""
-
-    raw_text = _extract_raw_text(result)
-
-    # Try to parse JSON directly from the model output.
-
-    def _parse_json_from_text(s: str):
-        if not s:
-            return None
-        # Attempt to find a JSON object in the text
-        # Find first '{' and last '}' to extract candidate JSON substring
-        start = s.find("{")
-        end = s.rfind("}")
-        if start == -1 or end == -1 or end <= start:
-            return None
-        candidate = s[start:end+1]
-        try:
-            parsed = json.loads(candidate)
-            # Validate structure
-            if isinstance(parsed, dict) and "sections" in parsed and isinstance(parsed["sections"], list):
-                # Normalize entries
-                sections = []
-                for sec in parsed["sections"]:
-                    title = sec.get("title", "").strip() if isinstance(sec, dict) else ""
-                    bullets = []
-                    if isinstance(sec, dict):
-                        b = sec.get("bullets", [])
-                        if isinstance(b, list):
-                            bullets = [str(x).strip() for x in b if x and str(x).strip()]
-                    sections.append({"title": title or "Untitled", "bullets": bullets})
-                return {"sections": sections}
-        except Exception:
-            return None
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", local_path],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        return int(float(out) * 1000)
+    except (subprocess.CalledProcessError, ValueError, OSError) as e:
+        log.warning("ffprobe failed for %s: %s", local_path, e)
         return None
 
-    parsed = _parse_json_from_text(raw_text)
-
-    # If JSON parse succeeded, return it.
-    if parsed:
-        return {"sections": parsed["sections"], "raw": raw_text}
+def _decode_pcm(local_path: str) -> bytes:
+    """
+    Decode audio with ffmpeg straight to raw PCM (s16le, mono, 16kHz) on stdout.
+    One copy of the samples in memory, instead of the several copies AudioSegment.from_file holds.
+    """
+    proc = subprocess.run(
+        ["ffmpeg", "-v", "error", "-i", local_path,
+         "-f", "s16le", "-ac", "1", "-ar", str(TRANSCRIBE_SAMPLE_RATE), "-"],
+        capture_output=True, check=True,
+    )
+    return proc.stdout
 
-    # Fallback: heuristically parse headings and bullets from plain text.
-    def _heuristic_parse(s: str):
-        lines = [ln.rstrip() for ln in s.splitlines()]
-        sections = []
-        current_title = None
-        current_bullets = []
+def _pcm_duration_ms(pcm) -> int:
+    return len(pcm) * 1000 // (TRANSCRIBE_SAMPLE_RATE * 2)
 
-        # Patterns that indicate a heading line
-        heading_patterns = [
-            re.compile(r'^\s*#{1,6}\s*(.+)$'),  # Markdown headings
-            re.compile(r'^\s*([A-Zא-ת][\w\s\-]{2,60}):\s*$'),  # "Title:" line (Latin or Hebrew)
-            re.compile(r'^\s*([A-Zא-ת][\w\s\-]{2,60})\s*$')  # Standalone Title line (Latin or Hebrew)
-        ]
+# פורמטים דחוסים ש-Transcribe מקבל כמו שהם: לא ממירים אותם ל-PCM/FLAC ולא מריצים עליהם preprocess
+_PASSTHROUGH_CONTENT_TYPES = {"mp3": "audio/mpeg", "mp4": "audio/mp4", "flac": "audio/flac", "ogg": "audio/ogg"}
 
-        # Bullet patterns
-        bullet_re = re.compile(r'^\s*([-•*]\s+)(.+)$')
-        numbered_re = re.compile(r'^\s*\d+[\.\)]\s+(.+)$')
+def cut_audio_chunk(local_path: str, out_path: str, start_ms: int, chunk_length_ms: int) -> str:
+    """חיתוך קטע מהקובץ המקורי בהעתקת ה-frames הדחוסים (-c copy) – בלי פענוח ובלי קידוד מחדש"""
+    subprocess.run(
+        ["ffmpeg", "-v", "error", "-y", "-ss", f"{start_ms / 1000}", "-t", f"{chunk_length_ms / 1000}",
+         "-i", local_path, "-c", "copy", out_path],
+        check=True,
+    )
+    return out_path
 
-        for ln in lines:
-            if not ln.strip():
-                continue
-            # Check for explicit bullet
-            m = bullet_re.match(ln)
-            if m:
-                text = m.group(2).strip()
-                if current_title is None:
-                    current_title = "General"
-                current_bullets.append(text)
-                continue
-            m2 = numbered_re.match(ln)
-            if m2:
-                text = m2.group(1).strip()
-                if current_title is None:
-                    current_title = "General"
-                current_bullets.append(text)
-                continue
-            # Check for heading patterns
-            is_heading = False
-            for hp in heading_patterns:
-                mh = hp.match(ln)
-                if mh:
-                    # flush previous section
-                    if current_title or current_bullets:
-                        sections.append({
-                            "title": current_title or "General",
-                            "bullets": current_bullets
-                        })
-                    current_title = mh.group(1).strip()
-                    current_bullets = []
-                    is_heading = True
-                    break
-            if is_heading:
-                continue
-            # If line is long and we have a current section, treat as bullet
-            if current_title:
-                current_bullets.append(ln.strip())
-            else:
-                # Start a general section
-                current_title = "General"
-                current_bullets.append(ln.strip())
-
-        # flush last
-        if current_title or current_bullets:
-            sections.append({
-                "title": current_title or "General",
-                "bullets": current_bullets
-            })
-        # Normalize: ensure bullets are strings and trimmed
-        for sec in sections:
-            sec["title"] = sec["title"].strip() if sec.get("title") else "Untitled"
-            sec["bullets"] = [b.strip() for b in sec.get("bullets", []) if b and b.strip()]
-        return sections
-
-    sections = _heuristic_parse(raw_text)
+def _infer_media_format(key: str) -> str:
+    ext = key.split(".")[-1].lower()
+    return {"wav":"wav","mp3":"mp3","flac":"flac","ogg":"ogg","mp4":"mp4","m4a":"mp4"}.get(ext, ext)
 
-    return {"sections": sections, "raw": raw_text}
+# --- Gemini structured output ---
+# Gemini מחזיר JSON לפי הסכמה (response_schema) – אין צורך לחפש JSON בתוך טקסט חופשי
+_STRING_LIST_SCHEMA = {"type": "ARRAY", "items": {"type": "STRING"}}
+_SUMMARY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "sections": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"title": {"type": "STRING"}, "bullets": _STRING_LIST_SCHEMA},
+                "required": ["title", "bullets"],
+            },
+        },
+        "participants": _STRING_LIST_SCHEMA,
+        "decisions": _STRING_LIST_SCHEMA,
+        "action_items": _STRING_LIST_SCHEMA,
+        "questions": _STRING_LIST_SCHEMA,
+    },
+    "required": ["sections"],
+}
+
+def _normalize_sections(sections: list) -> list:
+    result = []
+    for sec in sections:
+        title = str(sec.get("title") or "").strip()
+        bullets = [str(x).strip() for x in sec.get("bullets") or [] if x and str(x).strip()]
+        result.append({"title": title or "Untitled", "bullets": bullets})
+    return result
 
 def _gemini_summarize_and_answer(text: str, question: str = "") -> dict:
     """
@@ -268,7 +157,7 @@ def _gemini_summarize_and_answer(text: str, question: str = "") -> dict:
         log.error("[Gemini][ERROR] GEMINI_API_KEY is not set in environment")
         raise RuntimeError("Missing GEMINI_API_KEY")
 
-    client = genai.Client(api_key=GEMINI_API_KEY)
+    client = _get_gemini_client()
 
     # Build prompt (אם הטקסט ארוך מאוד, חיתוך בסיסי למניעת בעיות)
     max_prompt_chars = 200000  # ערך שמרני; ניתן לכוונן
@@ -314,150 +203,66 @@ def _gemini_summarize_and_answer(text: str, question: str = "") -> dict:
         result = client.models.generate_content(
             model=GEMINI_MODEL,
             contents=prompt,
-            config={"temperature": 0.0}
+            config={
+                "temperature": 0.0,
+                "response_mime_type": "application/json",
+                "response_schema": _SUMMARY_SCHEMA,
+            }
         )
         log.info("[Gemini] request sent, received response object type=%s", type(result))
     except Exception as e:
         log.exception("[Gemini][ERROR] API call failed: %s", e)
         raise
 
-    # Extract raw text from the SDK response using common response shapes.
-    def _extract_raw_text(res):
-        if hasattr(res, "output_text"):
-            try:
-                t = getattr(res, "output_text")
-                if t:
-                    return t
-            except Exception:
-                pass
-        out = getattr(res, "output", None)
-        if out:
-            try:
-                first = out[0]
-                if hasattr(first, "content"):
-                    c = first.content
-                    if isinstance(c, (list, tuple)) and len(c) > 0:
-                        texts = []
-                        for part in c:
-                            if hasattr(part, "text"):
-                                texts.append(getattr(part, "text") or "")
-                            elif isinstance(part, dict) and "text" in part:
-                                texts.append(part["text"] or "")
-                        joined = "\n".join([t for t in texts if t])
-                        if joined:
-                            return joined
-                if hasattr(first, "text"):
-                    return getattr(first, "text") or ""
-                if isinstance(first, dict) and "text" in first:
-                    return first["text"] or ""
-            except Exception:
-                pass
-        try:
-            return str(res)
-        except Exception:
-            return ""
-
-    raw_text = _extract_raw_text(result)
-    log.info("[Gemini] raw_text length=%d", len(raw_text) if raw_text else 0)
-
-    # Try to parse JSON directly from the model output.
-    def _parse_json_from_text(s: str):
-        if not s:
-            return None
-        start = s.find("{")
-        end = s.rfind("}")
-        if start == -1 or end == -1 or end <= start:
-            return None
-        candidate = s[start:end+1]
-        try:
-            parsed = json.loads(candidate)
-            if isinstance(parsed, dict) and "sections" in parsed and isinstance(parsed["sections"], list):
-                sections = []
-                for sec in parsed["sections"]:
-                    title = sec.get("title", "").strip() if isinstance(sec, dict) else ""
-                    bullets = []
-                    if isinstance(sec, dict):
-                        b = sec.get("bullets", [])
-                        if isinstance(b, list):
-                            bullets = [str(x).strip() for x in b if x and str(x).strip()]
-                    sections.append({"title": title or "Untitled", "bullets": bullets})
-                return {"sections": sections}
-        except Exception as e:
-            log.debug("[Gemini] JSON parse attempt failed: %s", e)
-            return None
-        return None
+    raw_text = result.text or ""
+    log.info("[Gemini] raw_text length=%d", len(raw_text))
+    try:
+        payload = orjson.loads(raw_text)
+    except orjson.JSONDecodeError as e:
+        log.error("[Gemini][ERROR] response is not valid JSON: %s", e)
+        raise RuntimeError(f"Gemini returned invalid JSON: {e}") from e
 
-    parsed = _parse_json_from_text(raw_text)
-    if parsed:
-        log.info("[Gemini] parsed JSON successfully with %d sections", len(parsed["sections"]))
-        return {"sections": parsed["sections"], "raw": raw_text}
-
-    # Fallback: heuristically parse headings and bullets from plain text.
-    log.info("[Gemini] falling back to heuristic parse")
-    def _heuristic_parse(s: str):
-        lines = [ln.rstrip() for ln in s.splitlines()]
-        sections = []
-        current_title = None
-        current_bullets = []
-        heading_patterns = [
-            re.compile(r'^\s*#{1,6}\s*(.+)$'),
-            re.compile(r'^\s*([A-Zא-ת][\w\s\-]{2,60}):\s*$'),
-            re.compile(r'^\s*([A-Zא-ת][\w\s\-]{2,60})\s*$')
-        ]
-        bullet_re = re.compile(r'^\s*([-•*]\s+)(.+)$')
-        numbered_re = re.compile(r'^\s*\d+[\.\)]\s+(.+)$')
-        for ln in lines:
-            if not ln.strip():
-                continue
-            m = bullet_re.match(ln)
-            if m:
-                text = m.group(2).strip()
-                if current_title is None:
-                    current_title = "General"
-                current_bullets.append(text)
-                continue
-            m2 = numbered_re.match(ln)
-            if m2:
-                text = m2.group(1).strip()
-                if current_title is None:
-                    current_title = "General"
-                current_bullets.append(text)
-                continue
-            is_heading = False
-            for hp in heading_patterns:
-                mh = hp.match(ln)
-                if mh:
-                    if current_title or current_bullets:
-                        sections.append({"title": current_title or "General", "bullets": current_bullets})
-                    current_title = mh.group(1).strip()
-                    current_bullets = []
-                    is_heading = True
-                    break
-            if is_heading:
-                continue
-            if current_title:
-                current_bullets.append(ln.strip())
-            else:
-                current_title = "General"
-                current_bullets.append(ln.strip())
-        if current_title or current_bullets:
-            sections.append({"title": current_title or "General", "bullets": current_bullets})
-        for sec in sections:
-            sec["title"] = sec["title"].strip() if sec.get("title") else "Untitled"
-            sec["bullets"] = [b.strip() for b in sec.get("bullets", []) if b and b.strip()]
-        return sections
-
-    sections = _heuristic_parse(raw_text)
-    log.info("[Gemini] heuristic parse produced %d sections", len(sections))
+    sections = _normalize_sections(payload.get("sections") or [])
+    log.info("[Gemini] parsed JSON successfully with %d sections", len(sections))
     return {"sections": sections, "raw": raw_text}
 
 
+def _summarize_with_cache(bucket: str, text: str) -> Tuple[dict, bytes]:
+    """
+    Gemini summary cached in S3 under summary_cache/<sha256>.json.
+    The hash covers the model name and the transcript, so reprocessing the same
+    audio returns the stored summary instead of paying for another Gemini call.
+    Returns the summary together with its serialized JSON bytes, so the caller can
+    write it out without encoding it again.
+    """
+    digest = hashlib.sha256(f"{GEMINI_MODEL}\n{text}".encode("utf-8")).hexdigest()
+    cache_key = f"summary_cache/{digest}.json"
+    try:
+        obj = s3_client.get_object(Bucket=bucket, Key=cache_key)
+        log.info("[Summarize] cache hit: s3://%s/%s", bucket, cache_key)
+        body = obj["Body"].read()
+        return orjson.loads(body), body
+    except ClientError as e:
+        log.info("[Summarize] cache miss (%s): %s", e.response["Error"]["Code"], cache_key)
+
+    summary = _gemini_summarize_and_answer(text)
+    body = orjson.dumps(summary)
+    try:
+        s3_client.put_object(Bucket=bucket, Key=cache_key, Body=body, ContentType="application/json")
+    except ClientError as e:
+        log.warning("[Summarize] failed to write cache entry %s: %s", cache_key, e)
+    return summary, body
+
+
+# כל תו שאינו מותר ב־Transcribe
+_UNSAFE_KEY_CHARS_RE = re.compile(r"[^a-zA-Z0-9\-_.!*'()/&$@=;:+,?]")
+
 def sanitize_key(name: str) -> str:
     # החלפת כל תו שאינו מותר ב־Transcribe ל־"_"
-    return re.sub(r"[^a-zA-Z0-9\-_.!*'()/&$@=;:+,?]", "_", name)
+    return _UNSAFE_KEY_CHARS_RE.sub("_", name)
 
 
-def _start_transcribe_job(bucket: str, base_name: str, part_key: str, idx: int) -> str:
+def _start_transcribe_job(bucket: str, base_name: str, part_key: str, idx: int) -> Tuple[str, str]:
     """
     Start a Transcribe job for a given chunk and save output under transcriptions/<base_name>/part_xxx.json
     """
@@ -467,110 +272,149 @@ def _start_transcribe_job(bucket: str, base_name: str, part_key: str, idx: int)
 
     out_key = f"transcriptions/{base_name}/part_{idx:03d}.json"
 
-    log.info("Starting Transcribe job: job_name=%s, media_uri=%s, format=%s, output_key=%s",
-             job_name, media_uri, media_format, out_key)
+    log.debug("Starting Transcribe job: job_name=%s, media_uri=%s, format=%s, output_key=%s",
+              job_name, media_uri, media_format, out_key)
+
+    with _TRANSCRIBE_SUBMIT_SLOTS:
+        transcribe_client.start_transcription_job(
+            TranscriptionJobName=job_name,
+            Media={"MediaFileUri": media_uri},
+            MediaFormat=media_format,
+            LanguageCode=TRANSCRIBE_LANGUAGE,
+            OutputBucketName=INPUT_BUCKET_NAME,
+            OutputKey=out_key
+        )
+    log.debug("Transcribe job %s submitted successfully", job_name)
+    return job_name, out_key
 
-    transcribe_client.start_transcription_job(
-        TranscriptionJobName=job_name,
-        Media={"MediaFileUri": media_uri},
-        MediaFormat=media_format,
-        LanguageCode=TRANSCRIBE_LANGUAGE,
-        OutputBucketName=INPUT_BUCKET_NAME,
-        OutputKey=out_key
-    )
-    log.info("Transcribe job %s submitted successfully", job_name)
-    return job_name
-
-
-def _merge_transcripts(bucket: str, base_name: str) -> str:
-    """Merge all transcript parts under transcriptions/<base_name>/ into one string"""
-    prefix = f"transcriptions/{base_name}/"
-    log.info("Starting merge of transcripts under prefix: %s", prefix)
-    resp = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    texts = []
-    for idx, obj in enumerate(sorted(resp.get("Contents", []), key=lambda x: x["Key"])):
-        log.info("Reading transcript file #%d from S3: %s", idx, obj["Key"])
-        body = s3_client.get_object(Bucket=bucket, Key=obj["Key"])["Body"].read().decode("utf-8")
-        payload = json.loads(body)
-        t = payload.get("results", {}).get("transcripts", [])
-        if t:
-            text = t[0].get("transcript", "")
-            log.info("Transcript #%d loaded from %s – length %d characters", idx, obj["Key"], len(text))
-            texts.append(text)
-    merged = "\n".join(texts)
-    log.info("Merge complete – merged %d transcripts, total length %d characters", len(texts), len(merged))
-    return merged
-
-def _wait_for_transcribe(job_name: str, timeout_sec: int = 600, poll_sec: int = 5) -> Optional[dict]:
-    start = time.time()
-    while time.time() - start < timeout_sec:
+
+def _transcript_text_from_body(body) -> str:
+    """
+    Stream results.transcripts[0].transcript out of a Transcribe output JSON.
+    The word-level "items" that follow it are never parsed or held in memory.
+    """
+    try:
+        return next(ijson.items(body, "results.transcripts.item.transcript"), "")
+    finally:
+        body.close()
+
+
+def _wait_for_transcribe(job_name: str, out_key: Optional[str] = None,
+                         timeout_sec: int = 600, max_delay_sec: int = 15) -> Optional[dict]:
+    """
+    Wait for a Transcribe job with exponential backoff (1s, 2s, 4s, 8s, capped at max_delay_sec).
+    If out_key is given, a HEAD on the output object is tried first – once it exists the job is done
+    and there is no need to call GetTranscriptionJob at all.
+    """
+    deadline = time.monotonic() + timeout_sec
+    attempt = 0
+    while time.monotonic() < deadline:
+        if out_key:
+            try:
+                s3_client.head_object(Bucket=INPUT_BUCKET_NAME, Key=out_key)
+                log.debug("Output for job %s found at s3://%s/%s", job_name, INPUT_BUCKET_NAME, out_key)
+                return {"TranscriptionJobName": job_name, "TranscriptionJobStatus": "COMPLETED"}
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                    raise
         resp = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
         job = resp["TranscriptionJob"]
         status = job["TranscriptionJobStatus"]
-        log.info("Polling job %s: status=%s", job_name, status)
+        log.debug("Polling job %s: status=%s", job_name, status)
         if status == "COMPLETED":
             return job
         if status == "FAILED":
             raise RuntimeError(f"Transcribe job failed: {job.get('FailureReason')}")
-        time.sleep(poll_sec)
+        time.sleep(min(max_delay_sec, 2 ** attempt))
+        attempt += 1
     return None
 
-def _read_transcript_from_s3(bucket: str, base_name: str, idx: int) -> str:
-    """
-    Read transcript text from known S3 key: transcriptions/<base_name>/part_xxx.json
-    """
-    key = f"transcriptions/{base_name}/part_{idx:03d}.json"
-    log.info("Reading transcript from s3://%s/%s", bucket, key)
+def _read_transcript_by_key(bucket: str, key: str) -> str:
+    """Read transcript text from the OutputKey the job was started with"""
+    log.debug("Reading transcript from s3://%s/%s", bucket, key)
     obj = s3_client.get_object(Bucket=bucket, Key=key)
-    data = obj["Body"].read().decode("utf-8")
-    payload = json.loads(data)
-    transcripts = payload.get("results", {}).get("transcripts", [])
-    return transcripts[0].get("transcript", "") if transcripts else ""
+    return _transcript_text_from_body(obj["Body"])
+
+# נרמול עוצמה + הסרת שקטים של שנייה ומעלה (משאירים 100ms), הכל ב-filtergraph אחד של ffmpeg
+_PREPROCESS_FILTER = ("loudnorm,"
+                      "silenceremove=stop_periods=-1:stop_duration=1:stop_threshold=-40dB:stop_silence=0.1")
+
+def _preprocess_cmd(local_path: str) -> list:
+    return ["ffmpeg", "-v", "error", "-y", "-i", local_path, "-af", _PREPROCESS_FILTER,
+            "-ac", "1", "-ar", str(TRANSCRIBE_SAMPLE_RATE), "-c:a", "flac"]
 
 def preprocess_audio(local_path: str, out_path: str):
     try:
-        log.info("Preprocess: loading audio from %s", local_path)
-        audio = AudioSegment.from_file(local_path)
-        log.info("Preprocess: normalizing volume")
-        normalized = effects.normalize(audio)
-        log.info("Preprocess: stripping silence (len>=1000ms, thresh=-40dBFS)")
-        cleaned = normalized.strip_silence(silence_len=1000, silence_thresh=-40)
-        cleaned.export(out_path, format="wav")
+        log.info("Preprocess: %s -> %s (filter=%s)", local_path, out_path, _PREPROCESS_FILTER)
+        subprocess.run(_preprocess_cmd(local_path) + [out_path], check=True)
         log.info("Preprocess: exported cleaned audio to %s", out_path)
         return out_path
     except Exception as e:
         log.error("Preprocess failed for %s: %s", local_path, e)
         raise
 
+def iter_preprocessed_chunks(local_path: str, out_dir: str, chunk_length_ms: int = 60000):
+    """
+    Decode, preprocess and split in a single ffmpeg pass (segment muxer, FLAC output).
+    ffmpeg prints every finished segment to the segment list on stdout, so (idx, path) is
+    yielded as soon as that chunk is complete, while the next one is still being encoded.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    cmd = _preprocess_cmd(local_path) + [
+        "-f", "segment", "-segment_time", f"{chunk_length_ms / 1000}",
+        "-segment_list", "pipe:1", "-segment_list_type", "flat",
+        os.path.join(out_dir, "part_%03d.flac"),
+    ]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as proc:
+        idx = 0
+        for line in proc.stdout:
+            name = line.strip()
+            if not name:
+                continue
+            yield idx, os.path.join(out_dir, os.path.basename(name))
+            idx += 1
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
 def _put_json(bucket: str, key: str, payload: dict):
     s3_client.put_object(
         Bucket=bucket,
         Key=key,
-        Body=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        Body=orjson.dumps(payload),
         ContentType="application/json",
     )
 
-def _transcribe_part(bucket: str, base_name: str, part_key: str, idx: int) -> dict:
-    # Start job
-    job_name = _start_transcribe_job(bucket, base_name, part_key, idx)
-    log.info("[Transcribe] Job started for %s: %s", part_key, job_name)
-
+def _upload_and_start_transcribe(bucket: str, base_name: str, part_key: str, idx: int, chunk_path: str,
+                                 content_type: str = "audio/flac") -> Tuple[str, str]:
+    # ה-chunk ממופה לזיכרון (mmap) ונשלח כ-Body – botocore קורא ישירות מהדפים הממופים, בלי read() לבאפר נוסף
+    with open(chunk_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+                s3_client.put_object(Bucket=bucket, Key=part_key, Body=mm, ContentType=content_type)
+        else:
+            s3_client.put_object(Bucket=bucket, Key=part_key, Body=b"", ContentType=content_type)
+    os.remove(chunk_path)
+    log.debug("[Chunk %d] uploaded to s3://%s/%s", idx, bucket, part_key)
+    return _start_transcribe_job(bucket, base_name, part_key, idx)
+
+def _transcribe_part(bucket: str, part_key: str, job_name: str, out_key: str) -> dict:
+    # ה-job כבר נשלח (ב-agent_handler כל ה-jobs נשלחים מראש) – כאן רק ממתינים וקוראים את התמליל
     # Wait complete
-    job = _wait_for_transcribe(job_name)
+    job = _wait_for_transcribe(job_name, out_key=out_key)
     if not job:
         raise RuntimeError(f"Transcribe job timeout for {part_key}")
     status = job["TranscriptionJobStatus"]
     if status != "COMPLETED":
         raise RuntimeError(f"Transcribe job failed for {part_key}: {job.get('FailureReason')}")
 
-    log.info("[Transcribe] Job %s completed for %s", job_name, part_key)
+    log.debug("[Transcribe] Job %s completed for %s", job_name, part_key)
 
     # Fetch transcript text from known S3 key
     text = None
     for attempt in range(5):
         try:
-            text = _read_transcript_from_s3(bucket, base_name, idx)
-            log.info("[Transcribe] Transcript length for %s: %d chars", part_key, len(text))
+            text = _read_transcript_by_key(bucket, out_key)
+            log.debug("[Transcribe] Transcript length for %s: %d chars", part_key, len(text))
             break
         except ClientError:
             time.sleep(2)
@@ -584,25 +428,24 @@ def generate_internal_id() -> str:
     """יוצר מזהה פנימי ייחודי לכל קובץ"""
     return str(uuid.uuid4())
 
-def _update_status(bucket: str, internal_id: str, original_name: str, **kwargs):
+def _update_status(bucket: str, status: dict, **kwargs):
     """
-    עדכון סטטוס: נשמר גם המזהה הפנימי וגם השם המקורי
+    עדכון סטטוס: המצב המלא מוחזק בזיכרון (כולל המזהה הפנימי והשם המקורי)
+    ונכתב ל-S3 ב-PUT יחיד, בלי קריאה מוקדמת של הקובץ הקיים.
+    נקרא רק בנקודות ביקורת – העלאה, סוף פיצול, סוף תמלול, סוף סיכום.
     """
-    status_key = f"statuses/{internal_id}.json"
-    current = {}
-    try:
-        obj = s3_client.get_object(Bucket=bucket, Key=status_key)
-        current = json.loads(obj["Body"].read().decode("utf-8"))
-    except Exception:
-        pass
-    current.update({
-        "updated_at": int(time.time()),
-        "internal_id": internal_id,
-        "original_name": original_name
-    })
-    current.update(kwargs)
-    _put_json(bucket, status_key, current)
-    log.info("Status updated: s3://%s/%s -> %s", bucket, status_key, current)
+    status.update(kwargs)
+    status["updated_at"] = int(time.time())
+    status_key = f"statuses/{status['internal_id']}.json"
+    _put_json(bucket, status_key, status)
+    log.debug("Status updated: s3://%s/%s -> %s", bucket, status_key, status)
+
+def _mark_part_done(bucket: str, internal_id: str, idx: int):
+    """
+    סימון חלק שתומלל: אובייקט ריק statuses/<internal_id>/part_xxx.done.
+    summary_handler סופר את הסימונים ב-list בלי GET לכל חלק.
+    """
+    s3_client.put_object(Bucket=bucket, Key=f"statuses/{internal_id}/part_{idx:03d}.done", Body=b"")
 
 def _build_manifest(internal_id: str, original_name: str, part_keys: list[str]) -> dict:
     """
@@ -621,85 +464,154 @@ def _build_manifest(internal_id: str, original_name: str, part_keys: list[str])
 
 
 def agent_handler(event, context):
-    log.info("=== agent_handler invoked === event=%s", json.dumps(event))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("=== agent_handler event === %s", json.dumps(event))
 
     # Parse S3 event
     bucket, key = _parse_s3_event(event)
+    log.info("=== agent_handler invoked === bucket=%s key=%s", bucket, key)
     original_name = key.split("/")[-1].rsplit(".", 1)[0]
     internal_id = generate_internal_id()
     log.info("[Init] bucket=%s, key=%s, original_name=%s, internal_id=%s", bucket, key, original_name, internal_id)
 
-    _update_status(bucket, internal_id, original_name, stage="uploaded", source_key=key)
+    status = {"internal_id": internal_id, "original_name": original_name,
+              "stage": "uploaded", "source_key": key}
+    # נקודת ביקורת: העלאה – ה-frontend רואה את הקובץ כבר בזמן ההורדה, ה-probe והפיצול
+    _update_status(bucket, status)
 
     # Download original file
     local_path = f"/tmp/{original_name}.wav"
     log.info("[Download] from s3://%s/%s -> %s", bucket, key, local_path)
-    s3_client.download_file(bucket, key, local_path)
+    s3_client.download_file(bucket, key, local_path, Config=_TRANSFER_CFG)
     log.info("[Download] completed")
 
-    # Split (על השם המקורי)
-    log.info("[Split] splitting audio into chunks (max 1 minute)")
-    chunk_paths = split_audio(local_path, chunk_length_ms=60000)
-    log.info("[Split] produced %d chunks", len(chunk_paths))
+    duration_ms = _probe_duration_ms(local_path)
+    if duration_ms is None:
+        duration_ms = _pcm_duration_ms(_decode_pcm(local_path))
+    log.info("[Probe] duration=%dms", duration_ms)
 
-    # Preprocess each chunk separately and upload (שימוש במזהה החדש)
     part_keys = []
-    for idx, chunk_path in enumerate(chunk_paths):
-        clean_chunk_path = f"/tmp/{internal_id}_chunk_{idx:03d}_clean.wav"
-        preprocess_audio(chunk_path, clean_chunk_path)
-        part_key = f"chunks/{internal_id}/part_{idx:03d}.wav"
-        s3_client.upload_file(clean_chunk_path, bucket, part_key)
-        log.info("[Chunk %d] uploaded to s3://%s/%s", idx, bucket, part_key)
-        part_keys.append(part_key)
-
-    # Build manifest
-    manifest = _build_manifest(internal_id, original_name, part_keys)
-    manifest_key = f"manifests/{internal_id}.json"
-    _update_status(bucket, internal_id, original_name, stage="split", total_parts=len(part_keys), manifest_key=manifest_key)
-    _put_json(bucket, manifest_key, manifest)
-    log.info("[Manifest] written to s3://%s/%s", bucket, manifest_key)
+    submitter = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    submit_futures = {}
+    # ה-pool נפתח לפני הפיצול; אם preprocess/חיתוך/כתיבת manifest נכשלים לפני ה-with שלמטה,
+    # סוגרים אותו כאן ומבטלים uploads/jobs שעוד לא התחילו – אחרת threads דולפים בין הפעלות חמות
+    try:
+        ext = key.rsplit(".", 1)[-1].lower()
+        content_type = _PASSTHROUGH_CONTENT_TYPES.get(_infer_media_format(key))
+        if duration_ms <= CHUNK_LENGTH_MS:
+            # קובץ קצר: Transcribe מקבל את הקובץ המקורי כמו שהוא, בלי preprocess והעלאה חוזרת
+            log.info("[Split] short file – transcribing original object s3://%s/%s", bucket, key)
+            part_keys.append(key)
+        elif content_type and not CHUNKED_TRANSCRIBE and duration_ms <= TRANSCRIBE_MAX_DURATION_MS:
+            # קובץ דחוס בפורמט נתמך: job יחיד על האובייקט המקורי – WAV/FLAC מנורמל היה גדול פי כמה
+            log.info("[Split] compressed %s input – transcribing original object s3://%s/%s", ext, bucket, key)
+            part_keys.append(key)
+        elif not CHUNKED_TRANSCRIBE and duration_ms <= TRANSCRIBE_MAX_DURATION_MS:
+            # job יחיד על הקובץ המלא אחרי preprocess – בלי פיצול ובלי מיזוג
+            log.info("[Split] single Transcribe job on the full preprocessed file")
+            clean_path = f"/tmp/{internal_id}_clean.flac"
+            preprocess_audio(local_path, clean_path)
+            part_key = f"chunks/{internal_id}/part_000.flac"
+            s3_client.upload_file(clean_path, bucket, part_key, ExtraArgs={"ContentType": "audio/flac"},
+                                  Config=_TRANSFER_CFG)
+            log.info("[Upload] uploaded to s3://%s/%s", bucket, part_key)
+            part_keys.append(part_key)
+        elif content_type:
+            # חיתוך בקונטיינר המקורי (-c copy): כל chunk נחתך, מועלה ונשלח ל-Transcribe ברקע
+            log.info("[Split] cutting %s input into chunks with stream copy (max 1 minute)", ext)
+            for idx, start_ms in enumerate(range(0, duration_ms, CHUNK_LENGTH_MS)):
+                chunk_path = cut_audio_chunk(local_path, f"/tmp/{internal_id}_part_{idx:03d}.{ext}",
+                                             start_ms, CHUNK_LENGTH_MS)
+                part_key = f"chunks/{internal_id}/part_{idx:03d}.{ext}"
+                future = submitter.submit(_upload_and_start_transcribe, bucket, internal_id, part_key, idx,
+                                          chunk_path, content_type)
+                submit_futures[future] = idx
+                part_keys.append(part_key)
+            log.info("[Split] produced %d chunks", len(part_keys))
+        else:
+            # Pipeline: ffmpeg אחד מפענח, מנקה ומפצל; כל chunk שנסגר מועלה ונשלח ל-Transcribe ברקע
+            # בזמן ש-ffmpeg ממשיך ל-chunk הבא
+            log.info("[Split] preprocessing and splitting audio in one ffmpeg pass (max 1 minute)")
+            for idx, chunk_path in iter_preprocessed_chunks(local_path, f"/tmp/{internal_id}_chunks",
+                                                            chunk_length_ms=CHUNK_LENGTH_MS):
+                part_key = f"chunks/{internal_id}/part_{idx:03d}.flac"
+                future = submitter.submit(_upload_and_start_transcribe, bucket, internal_id, part_key, idx, chunk_path)
+                submit_futures[future] = idx
+                part_keys.append(part_key)
+            log.info("[Split] produced %d chunks", len(part_keys))
+
+        # חלקים שכבר נמצאים ב-S3 (קובץ קצר / job יחיד) – נשאר רק לשלוח את ה-job
+        if not submit_futures:
+            for idx, k in enumerate(part_keys):
+                submit_futures[submitter.submit(_start_transcribe_job, bucket, internal_id, k, idx)] = idx
+
+        # Build manifest
+        manifest = _build_manifest(internal_id, original_name, part_keys)
+        manifest_key = f"manifests/{internal_id}.json"
+        _put_json(bucket, manifest_key, manifest)
+        log.info("[Manifest] written to s3://%s/%s", bucket, manifest_key)
+
+        # נקודת ביקורת: סוף פיצול – התמלול מתחיל מיד
+        _update_status(bucket, status, stage="transcribe_in_progress",
+                       total_parts=len(part_keys), manifest_key=manifest_key)
+    except BaseException:
+        submitter.shutdown(wait=True, cancel_futures=True)
+        raise
 
     # Transcribe (שימוש במזהה החדש)
-    _update_status(bucket, internal_id, original_name, stage="transcribe_in_progress", total_parts=len(part_keys))
-    results, errors = [], []
-    max_workers = min(8, len(part_keys)) or 1
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_idx = {executor.submit(_transcribe_part, bucket, internal_id, k, idx): idx
-                         for idx, k in enumerate(part_keys)}
+    # שלב 1: איסוף ה-jobs שנשלחו (fan-out), כך שכולם רצים ב-Transcribe במקביל
+    n_parts = len(part_keys)
+    jobs: List[Optional[Tuple[str, str]]] = [None] * n_parts  # (job_name, out_key)
+    results: List[Optional[dict]] = [None] * n_parts
+    errors = []
+
+    with submitter:
+        for future in concurrent.futures.as_completed(submit_futures):
+            idx = submit_futures[future]
+            try:
+                jobs[idx] = future.result()
+            except Exception as e:
+                log.error("[Transcribe] submit failed for part %s: %s", part_keys[idx], e)
+                errors.append({"part_key": part_keys[idx], "error": str(e)})
+
+    # שלב 2: המתנה מקבילית לכל ה-jobs שנשלחו; התוצאות נשמרות לפי האינדקס המקורי (סדר האודיו)
+    submitted = [idx for idx, job in enumerate(jobs) if job]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(10, len(submitted)) or 1) as waiter:
+        future_to_idx = {waiter.submit(_transcribe_part, bucket, part_keys[idx], *jobs[idx]): idx
+                         for idx in submitted}
         for future in concurrent.futures.as_completed(future_to_idx):
             idx = future_to_idx[future]
             k = part_keys[idx]
             try:
-                res = future.result()
-                results.append(res)
-                _update_status(bucket, internal_id, original_name,
-                               stage="transcribe_in_progress",
-                               completed_parts=len(results),
-                               last_completed=k)
+                results[idx] = future.result()
+                _mark_part_done(bucket, internal_id, idx)
             except Exception as e:
+                log.error("[Transcribe] part %s failed: %s", k, e)
                 errors.append({"part_key": k, "error": str(e)})
-                _update_status(bucket, internal_id, original_name,
-                               stage="transcribe_in_progress",
-                               error_for=k,
-                               error=str(e))
 
     if errors:
-        _update_status(bucket, internal_id, original_name, stage="transcribe_failed", errors=errors)
+        _update_status(bucket, status, stage="transcribe_failed",
+                       completed_parts=sum(r is not None for r in results), errors=errors)
         raise RuntimeError(f"Transcribe failed: {errors}")
 
-    _update_status(bucket, internal_id, original_name, stage="transcribe_completed", completed_parts=len(results))
-
     # Merge transcripts (עדיין לפי internal_id)
-    texts = [r["text"] for r in sorted(results, key=lambda r: r["part_key"])]
-    full_text = "\n".join(texts)
-    merged_payload = {"internal_id": internal_id,
-                      "original_name": original_name,
-                      "parts": [r["part_key"] for r in sorted(results, key=lambda r: r["part_key"])],
-                      "text": full_text}
-    merged_key = f"transcriptions/{internal_id}/merged.json"
-    _put_json(bucket, merged_key, merged_payload)
-    _update_status(bucket, internal_id, original_name, stage="merged", merged_key=merged_key)
+    if len(results) == 1:
+        # חלק יחיד – אין מה למזג, התמליל של החלק הוא התמליל המלא
+        full_text = results[0]["text"]
+        merged_key = f"transcriptions/{internal_id}/part_000.json"
+    else:
+        buf = io.StringIO()
+        for i, r in enumerate(results):
+            if i:
+                buf.write("\n")
+            buf.write(r["text"])
+        full_text = buf.getvalue()
+        merged_payload = {"internal_id": internal_id,
+                          "original_name": original_name,
+                          "parts": [r["part_key"] for r in results],
+                          "text": full_text}
+        merged_key = f"transcriptions/{internal_id}/merged.json"
+        _put_json(bucket, merged_key, merged_payload)
 
     # Summarize (שימוש בשם המקורי לסיכום) - עם לוגים וטיפול בשגיאות
     try:
@@ -711,11 +623,12 @@ def agent_handler(event, context):
         if merged_len == 0:
             raise RuntimeError("Merged transcript is empty, nothing to summarize")
 
-        # עדכון סטטוס תחילת סיכום
-        _update_status(bucket, internal_id, original_name, stage="summarize_in_progress", merged_key=merged_key)
+        # נקודת ביקורת: סוף תמלול – תחילת סיכום
+        _update_status(bucket, status, stage="summarize_in_progress",
+                       completed_parts=len(results), merged_key=merged_key)
 
-        # קריאה ל־Gemini (הפונקציה מטפלת בלוגים פנימיים)
-        summary = _gemini_summarize_and_answer(full_text)
+        # קריאה ל־Gemini (הפונקציה מטפלת בלוגים פנימיים), או סיכום קיים מה-cache
+        summary, summary_body = _summarize_with_cache(bucket, full_text)
 
         # בדיקות על התוצאה
         if not isinstance(summary, dict) or "sections" not in summary:
@@ -730,12 +643,12 @@ def agent_handler(event, context):
         s3_client.put_object(
             Bucket=bucket,
             Key=out_key,
-            Body=json.dumps(summary, ensure_ascii=False).encode("utf-8"),
+            Body=summary_body,
             ContentType="application/json"
         )
 
         # עדכון סטטוס סופי
-        _update_status(bucket, internal_id, original_name, stage="summarized", summary_key=out_key)
+        _update_status(bucket, status, stage="summarized", summary_key=out_key)
         log.info("[Summarize] completed successfully for internal_id=%s summary_key=%s", internal_id, out_key)
 
     except Exception as e:
@@ -743,7 +656,7 @@ def agent_handler(event, context):
         log.exception("[Summarize][ERROR] failed to produce summary for internal_id=%s: %s", internal_id, e)
         # עדכון סטטוס כושל עם פרטי השגיאה (מועיל ל־frontend ולדיאגנוסטיקה)
         try:
-            _update_status(bucket, internal_id, original_name, stage="summarize_failed", errors=str(e))
+            _update_status(bucket, status, stage="summarize_failed", errors=str(e))
         except Exception:
             log.exception("[Summarize][ERROR] failed to update status for internal_id=%s", internal_id)
         # להחליט אם להחזיר שגיאה (מעלה retry) או להחזיר תשובה מבוקרת.
@@ -761,147 +674,3 @@ def agent_handler(event, context):
             "original_name": original_name
         }, ensure_ascii=False)
     }
-
-
-
-
-    
-
-
-
-def _find_internal_id_by_original(bucket: str, original_name: str) -> str | None:
-    """
-    חיפוש internal_id בקבצי statuses/ או manifests/ לפי original_name.
-    מאפשר ל-Frontend לשלוח fileName בלבד, והפונקציה תמצא את ה-ID הפנימי.
-    """
-    try:
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix="statuses/")
-        for obj in response.get("Contents", []):
-            key = obj["Key"]
-            status_obj = s3_client.get_object(Bucket=bucket, Key=key)
-            status_data = json.loads(status_obj["Body"].read().decode("utf-8"))
-            if status_data.get("original_name") == original_name:
-                return status_data.get("internal_id")
-    except Exception as e:
-        log.warning("Failed scanning statuses: %s", e)
-
-    try:
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix="manifests/")
-        for obj in response.get("Contents", []):
-            key = obj["Key"]
-            manifest_obj = s3_client.get_object(Bucket=bucket, Key=key)
-            manifest_data = json.loads(manifest_obj["Body"].read().decode("utf-8"))
-            if manifest_data.get("original_name") == original_name:
-                return manifest_data.get("internal_id")
-    except Exception as e:
-        log.warning("Failed scanning manifests: %s", e)
-
-    return None
-
-
-def summary_handler(event, context):
-    """
-    מחזיר סיכום אם הוא מוכן, אחרת מחזיר סטטוס התקדמות.
-    תומך גם בפרמטר id (internal_id) וגם בפרמטר fileName (original_name).
-    אם נשלח fileName בלבד, הפונקציה תמצא את ה-internal_id המתאים לפי statuses/manifests.
-    """
-
-    params = event.get("queryStringParameters") or {}
-    file_name = params.get("fileName")
-    internal_id = params.get("id")
-
-    # אם לא נשלח id אבל יש fileName – ננסה למצוא internal_id לפי original_name
-    if not internal_id and file_name:
-        base_name = file_name.rsplit(".", 1)[0]
-        internal_id = _find_internal_id_by_original(INPUT_BUCKET_NAME, base_name)
-
-    if not internal_id:
-        return {
-            "statusCode": 404,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"error": "No status or manifest found for given file"})
-        }
-
-    status_key = f"statuses/{internal_id}.json"
-    manifest_key = f"manifests/{internal_id}.json"
-
-    # קודם ננסה להחזיר את הסיכום אם הוא מוכן
-    try:
-        status_obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=status_key)
-        status_data = json.loads(status_obj["Body"].read().decode("utf-8"))
-        summary_key = status_data.get("summary_key")
-        if summary_key:
-            obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=summary_key)
-            body = obj["Body"].read().decode("utf-8")
-            log.info("[SummaryHandler] summary found at s3://%s/%s", INPUT_BUCKET_NAME, summary_key)
-            return {
-                "statusCode": 200,
-                "headers": {"Content-Type": "application/json"},
-                "body": body
-            }
-    except ClientError as e:
-        if e.response["Error"]["Code"] != "NoSuchKey":
-            log.error("[SummaryHandler] error reading summary: %s", e)
-            return {
-                "statusCode": 500,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({"error": str(e)})
-            }
-        log.info("[SummaryHandler] summary not found yet, checking status")
-
-    # אם אין סיכום עדיין – נחזיר סטטוס התקדמות
-    try:
-        status_obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=status_key)
-        status_data = json.loads(status_obj["Body"].read().decode("utf-8"))
-        log.info("[SummaryHandler] status loaded successfully: %s", status_data)
-
-        # ננסה להעשיר את הנתונים עם manifest כדי לדעת כמה חלקים יש
-        try:
-            manifest_obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=manifest_key)
-            manifest_data = json.loads(manifest_obj["Body"].read().decode("utf-8"))
-            status_data["total_parts"] = manifest_data.get("total_parts")
-        except ClientError:
-            pass
-
-        if status_data.get("stage") in ("transcribe_failed", "convert_failed", "preprocess_failed") or "errors" in status_data:
-            log.error("[SummaryHandler] processing failed: %s", status_data.get("errors"))
-            return {
-                "statusCode": 500,
-                "headers": {"Content-Type": "application/json"},
-                "body": json.dumps({
-                    "error": "Processing failed",
-                    "details": status_data.get("errors", []),
-                    "stage": status_data.get("stage"),
-                    "attempts": status_data.get("attempts")
-                }, ensure_ascii=False)
-            }
-
-        # אחרת נחזיר דוח התקדמות
-        return {
-            "statusCode": 202,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({
-                "status": "in-progress",
-                "stage": status_data.get("stage"),
-                "total_parts": status_data.get("total_parts"),
-                "completed_parts": status_data.get("completed_parts"),
-                "updated_at": status_data.get("updated_at"),
-                "last_completed": status_data.get("last_completed"),
-                "error_for": status_data.get("error_for"),
-                "attempts": status_data.get("attempts"),
-                "errors": status_data.get("errors"),
-                "original_name": status_data.get("original_name"),
-                "internal_id": status_data.get("internal_id")
-            }, ensure_ascii=False)
-        }
-
-    except Exception as e:
-        log.exception("[SummaryHandler] Unexpected error while reading status")
-        return {
-            "statusCode": 500,
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps({"error": str(e)})
-        }
-
-
-
@@ -2,9 +2,11 @@
 import os
 import json
 import boto3
+from botocore.config import Config
 
 INPUT_BUCKET_NAME = os.environ.get("INPUT_BUCKET_NAME")
-s3_client = boto3.client("s3", region_name="us-east-1")
+s3_client = boto3.client("s3", region_name="us-east-1",
+                         config=Config(retries={"max_attempts": 3, "mode": "adaptive"}, tcp_keepalive=True))
 
 def presign_handler(event, context):
     """
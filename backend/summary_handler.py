@@ -0,0 +1,168 @@
+# summary_handler.py
+# מחזיר ל-frontend סיכום מוכן או דוח התקדמות – בלי התלויות של עיבוד האודיו וה-LLM
+import os
+import json
+import logging
+import functools
+import boto3
+from botocore.config import Config
+import orjson
+from botocore.exceptions import ClientError
+
+log = logging.getLogger()
+log.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
+INPUT_BUCKET_NAME = os.environ.get("INPUT_BUCKET_NAME")
+s3_client = boto3.client("s3", region_name="us-east-1",
+                         config=Config(retries={"max_attempts": 3, "mode": "adaptive"}, tcp_keepalive=True))
+
+
+def _count_done_parts(bucket: str, internal_id: str) -> int:
+    resp = s3_client.list_objects_v2(Bucket=bucket, Prefix=f"statuses/{internal_id}/")
+    return resp.get("KeyCount", 0)
+
+def _find_internal_id_by_original(bucket: str, original_name: str) -> str | None:
+    """
+    חיפוש internal_id בקבצי statuses/ או manifests/ לפי original_name.
+    מאפשר ל-Frontend לשלוח fileName בלבד, והפונקציה תמצא את ה-ID הפנימי.
+    """
+    # Delimiter="/": רק קבצי ה-JSON ברמה העליונה; סימוני part_xxx.done תחת statuses/<internal_id>/
+    # מקובצים ל-CommonPrefixes ולא נספרים במגבלת 1000 המפתחות של כל דף. ה-paginator ממשיך לדפים הבאים.
+    paginator = s3_client.get_paginator("list_objects_v2")
+    try:
+        for page in paginator.paginate(Bucket=bucket, Prefix="statuses/", Delimiter="/"):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                if not key.endswith(".json"):
+                    continue
+                status_obj = s3_client.get_object(Bucket=bucket, Key=key)
+                status_data = orjson.loads(status_obj["Body"].read())
+                if status_data.get("original_name") == original_name:
+                    return status_data.get("internal_id")
+    except Exception as e:
+        log.warning("Failed scanning statuses: %s", e)
+
+    try:
+        for page in paginator.paginate(Bucket=bucket, Prefix="manifests/", Delimiter="/"):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                manifest_obj = s3_client.get_object(Bucket=bucket, Key=key)
+                manifest_data = orjson.loads(manifest_obj["Body"].read())
+                if manifest_data.get("original_name") == original_name:
+                    return manifest_data.get("internal_id")
+    except Exception as e:
+        log.warning("Failed scanning manifests: %s", e)
+
+    return None
+
+
+_PROGRESS_FIELDS = ("stage", "total_parts", "completed_parts", "updated_at", "last_completed",
+                    "error_for", "attempts", "errors", "original_name", "internal_id")
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_progress_body(values: tuple) -> str:
+    """
+    גוף JSON של דוח התקדמות. ה-frontend מתשאל שוב ושוב ורוב התשובות זהות
+    (אותו updated_at ואותו מספר חלקים), לכן הסריאליזציה נשמרת ב-cache לפי הערכים.
+    """
+    body = {"status": "in-progress"}
+    body.update(zip(_PROGRESS_FIELDS, values))
+    return orjson.dumps(body).decode("utf-8")
+
+
+def summary_handler(event, context):
+    """
+    מחזיר סיכום אם הוא מוכן, אחרת מחזיר סטטוס התקדמות.
+    תומך גם בפרמטר id (internal_id) וגם בפרמטר fileName (original_name).
+    אם נשלח fileName בלבד, הפונקציה תמצא את ה-internal_id המתאים לפי statuses/manifests.
+    """
+
+    params = event.get("queryStringParameters") or {}
+    file_name = params.get("fileName")
+    internal_id = params.get("id")
+
+    # אם לא נשלח id אבל יש fileName – ננסה למצוא internal_id לפי original_name
+    if not internal_id and file_name:
+        base_name = file_name.rsplit(".", 1)[0]
+        internal_id = _find_internal_id_by_original(INPUT_BUCKET_NAME, base_name)
+
+    if not internal_id:
+        return {
+            "statusCode": 404,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": "No status or manifest found for given file"})
+        }
+
+    status_key = f"statuses/{internal_id}.json"
+    manifest_key = f"manifests/{internal_id}.json"
+
+    # קודם ננסה להחזיר את הסיכום אם הוא מוכן
+    try:
+        status_obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=status_key)
+        status_data = orjson.loads(status_obj["Body"].read())
+        summary_key = status_data.get("summary_key")
+        if summary_key:
+            obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=summary_key)
+            body = obj["Body"].read().decode("utf-8")
+            log.info("[SummaryHandler] summary found at s3://%s/%s", INPUT_BUCKET_NAME, summary_key)
+            return {
+                "statusCode": 200,
+                "headers": {"Content-Type": "application/json"},
+                "body": body
+            }
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            log.error("[SummaryHandler] error reading summary: %s", e)
+            return {
+                "statusCode": 500,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({"error": str(e)})
+            }
+        log.info("[SummaryHandler] summary not found yet, checking status")
+
+    # אם אין סיכום עדיין – נחזיר סטטוס התקדמות
+    try:
+        status_obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=status_key)
+        status_data = orjson.loads(status_obj["Body"].read())
+        log.debug("[SummaryHandler] status loaded successfully: %s", status_data)
+
+        # ננסה להעשיר את הנתונים עם manifest כדי לדעת כמה חלקים יש
+        try:
+            manifest_obj = s3_client.get_object(Bucket=INPUT_BUCKET_NAME, Key=manifest_key)
+            manifest_data = orjson.loads(manifest_obj["Body"].read())
+            status_data["total_parts"] = manifest_data.get("total_parts")
+        except ClientError:
+            pass
+
+        # התקדמות התמלול נספרת מסימוני part_xxx.done (list בלבד, בלי GET לכל חלק)
+        if status_data.get("stage") == "transcribe_in_progress":
+            status_data["completed_parts"] = _count_done_parts(INPUT_BUCKET_NAME, internal_id)
+
+        if status_data.get("stage") in ("transcribe_failed", "convert_failed", "preprocess_failed") or "errors" in status_data:
+            log.error("[SummaryHandler] processing failed: %s", status_data.get("errors"))
+            return {
+                "statusCode": 500,
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps({
+                    "error": "Processing failed",
+                    "details": status_data.get("errors", []),
+                    "stage": status_data.get("stage"),
+                    "attempts": status_data.get("attempts")
+                }, ensure_ascii=False)
+            }
+
+        # אחרת נחזיר דוח התקדמות
+        return {
+            "statusCode": 202,
+            "headers": {"Content-Type": "application/json"},
+            "body": _render_progress_body(tuple(status_data.get(f) for f in _PROGRESS_FIELDS))
+        }
+
+    except Exception as e:
+        log.exception("[SummaryHandler] Unexpected error while reading status")
+        return {
+            "statusCode": 500,
+            "headers": {"Content-Type": "application/json"},
+            "body": json.dumps({"error": str(e)})
+        }
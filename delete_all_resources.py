@@ -5,11 +5,25 @@
 # python delete_all_resources.py --role-arn arn:aws:iam::123456789012:role/AdminRole
 
 import argparse
+import queue
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
 import botocore
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoRegionError
 
 REGION_DEFAULT = "us-east-1"
+CONCURRENCY_DEFAULT = 8
+# מחיקת stack קטן מסתיימת תוך פחות מדקה; polling כל 6 שניות (במקום 30) עם אותו חלון המתנה כולל של שעה
+STACK_DELETE_WAITER_CONFIG = {"Delay": 6, "MaxAttempts": 600}
+# pool גדול מספיק לכל ה-threads (באקטים × concurrency) + retries אדפטיביים מול SlowDown של S3
+BOTO_CONFIG = Config(
+    max_pool_connections=64,
+    retries={"max_attempts": 10, "mode": "adaptive"},
+    tcp_keepalive=True,
+)
 
 BUCKETS = [
     "rene-gemini-agent-user-input-2025",
@@ -63,68 +77,88 @@ def bucket_exists(s3, bucket):
         return False
 
 
-def empty_bucket(s3, bucket):
-    print(f"\n🔄 Emptying bucket: {bucket}")
-
-    if not bucket_exists(s3, bucket):
-        return
+def _put_batch(batches, objects, consumers):
+    """מכניס batch לתור החסום; מוותר אם כל ה-consumers כבר יצאו (אחרת put היה נתקע לנצח)."""
+    while True:
+        try:
+            batches.put(objects, timeout=0.5)
+            return
+        except queue.Full:
+            if all(f.done() for f in consumers):
+                raise RuntimeError("all delete consumers exited; aborting listing")
 
-    try:
-        s3.put_bucket_versioning(Bucket=bucket, VersioningConfiguration={"Status": "Suspended"})
-    except ClientError as e:
-        print(f"⚠️ Could not suspend versioning for '{bucket}': {e}")
 
-    paginator = s3.get_paginator("list_object_versions")
+def _list_versions_into_queue(s3, bucket, batches, listing_done, consumers):
+    """Producer: מעביר לתור batches של עד 1000 versions/markers, דף אחרי דף של ה-listing."""
     try:
-        pages = paginator.paginate(Bucket=bucket)
-    except ClientError as e:
+        paginator = s3.get_paginator("list_object_versions")
+        # deque: שליפת 1000 מפתחות מהראש ב-O(1) לכל פריט, בלי להעתיק את הזנב כמו batch[1000:]
+        batch = collections.deque()
+        for page in paginator.paginate(Bucket=bucket, PaginationConfig={"PageSize": 1000}):
+            for v in page.get("Versions", []):
+                batch.append({"Key": v["Key"], "VersionId": v["VersionId"]})
+            for m in page.get("DeleteMarkers", []):
+                batch.append({"Key": m["Key"], "VersionId": m["VersionId"]})
+
+            while len(batch) >= 1000:
+                _put_batch(batches, [batch.popleft() for _ in range(1000)], consumers)
+
+        if batch:
+            _put_batch(batches, list(batch), consumers)
+    except Exception as e:
         print(f"❌ Failed to paginate object versions in '{bucket}': {e}")
-        return
-
-    batch = []
-    for page in pages:
-        for v in page.get("Versions", []):
-            batch.append({"Key": v["Key"], "VersionId": v["VersionId"]})
-        for m in page.get("DeleteMarkers", []):
-            batch.append({"Key": m["Key"], "VersionId": m["VersionId"]})
+    finally:
+        listing_done.set()
 
-        while len(batch) >= 1000:
-            chunk = {"Objects": batch[:1000], "Quiet": True}
-            try:
-                resp = s3.delete_objects(Bucket=bucket, Delete=chunk)
-                print(f"✅ Deleted {len(resp.get('Deleted', []))} versions/markers; Errors: {resp.get('Errors', [])}")
-            except ClientError as e:
-                print(f"❌ delete_objects chunk failed: {e}")
-            batch = batch[1000:]
 
-    if batch:
+def _delete_batches_from_queue(s3, bucket, batches, listing_done):
+    """Consumer: מוחק batches מהתור עד שה-listing הסתיים והתור התרוקן."""
+    while True:
         try:
-            resp = s3.delete_objects(Bucket=bucket, Delete={"Objects": batch, "Quiet": True})
-            print(f"✅ Deleted final {len(resp.get('Deleted', []))} versions/markers; Errors: {resp.get('Errors', [])}")
-        except ClientError as e:
-            print(f"❌ delete_objects final batch failed: {e}")
+            objects = batches.get(timeout=0.5)
+        except queue.Empty:
+            if listing_done.is_set() and batches.empty():
+                return
+            continue
+        try:
+            resp = s3.delete_objects(Bucket=bucket, Delete={"Objects": objects, "Quiet": True})
+            # במצב Quiet התשובה מחזירה רק שגיאות
+            errors = resp.get("Errors", [])
+            print(f"✅ Deleted {len(objects) - len(errors)} versions/markers; Errors: {errors}")
+        except Exception as e:
+            # גם BotoCoreError (למשל EndpointConnectionError אחרי retries) – ה-consumer ממשיך לרוקן את התור
+            print(f"❌ delete_objects chunk failed: {e}")
+
+
+def empty_bucket(s3, bucket, concurrency=CONCURRENCY_DEFAULT, verify=False):
+    print(f"\n🔄 Emptying bucket: {bucket}")
 
-    # נרוקן גם אובייקטים רגילים (non-versioned)
     try:
-        obj_paginator = s3.get_paginator("list_objects_v2")
-        obj_pages = obj_paginator.paginate(Bucket=bucket)
-        keys = []
-        for p in obj_pages:
-            for o in p.get("Contents", []):
-                keys.append({"Key": o["Key"]})
-        if keys:
-            print(f"🧹 Deleting {len(keys)} current objects (non-versioned).")
-            for i in range(0, len(keys), 1000):
-                chunk = {"Objects": keys[i : i + 1000], "Quiet": True}
-                try:
-                    resp = s3.delete_objects(Bucket=bucket, Delete=chunk)
-                    print(f"✅ Deleted {len(resp.get('Deleted', []))} current objects; Errors: {resp.get('Errors', [])}")
-                except ClientError as e:
-                    print(f"❌ delete_objects (current objects) failed: {e}")
+        s3.put_bucket_versioning(Bucket=bucket, VersioningConfiguration={"Status": "Suspended"})
     except ClientError as e:
-        print(f"ℹ️ list_objects_v2 info: {e}")
+        print(f"⚠️ Could not suspend versioning for '{bucket}': {e}")
 
-    # בדיקה אחרונה
+    # list_object_versions מחזיר גם את האובייקטים הנוכחיים (בבאקט לא-versioned עם VersionId="null"),
+    # כך שמעבר אחד מרוקן את הבאקט – אין צורך במעבר נוסף של list_objects_v2.
+    # ה-listing (producer) והמחיקות (consumers) רצים במקביל: בזמן שדף ה-listing הבא בדרך,
+    # ה-batches הקודמים כבר נמחקים. לכל היותר `concurrency` קריאות delete_objects בטיסה ועוד
+    # 2*concurrency batches ממתינים בתור (≤16 עבור ברירת המחדל) – חלון חסום שלא צובר זיכרון.
+    batches = queue.Queue(maxsize=2 * concurrency)
+    listing_done = threading.Event()
+    with ThreadPoolExecutor(max_workers=concurrency + 1) as executor:
+        consumers = [
+            executor.submit(_delete_batches_from_queue, s3, bucket, batches, listing_done)
+            for _ in range(concurrency)
+        ]
+        producer = executor.submit(_list_versions_into_queue, s3, bucket, batches, listing_done, consumers)
+        for fut in as_completed([producer, *consumers]):
+            exc = fut.exception()
+            if exc is not None:
+                print(f"❌ Emptying worker for '{bucket}' failed: {exc}")
+
+    # בדיקה אחרונה (רק עם --verify; delete_bucket ממילא ייכשל אם נשאר תוכן)
+    if not verify:
+        return
     try:
         final = s3.list_object_versions(Bucket=bucket)
         v_left = len(final.get("Versions", []))
@@ -137,9 +171,6 @@ def empty_bucket(s3, bucket):
 def delete_bucket(s3, bucket):
     print(f"🗑️ Deleting bucket: {bucket}")
 
-    if not bucket_exists(s3, bucket):
-        return
-
     try:
         s3.delete_bucket(Bucket=bucket)
         print(f"✅ Bucket '{bucket}' delete initiated.")
@@ -193,7 +224,7 @@ def delete_stack(cf, stack_name):
         cf.delete_stack(StackName=stack_name)
         print(f"✅ Stack delete initiated for '{stack_name}'. Waiting for completion...")
         waiter = cf.get_waiter("stack_delete_complete")
-        waiter.wait(StackName=stack_name)
+        waiter.wait(StackName=stack_name, WaiterConfig=STACK_DELETE_WAITER_CONFIG)
         print(f"🎉 Stack '{stack_name}' deleted.")
     except ClientError as e:
         print(f"❌ Failed to delete stack '{stack_name}': {e}")
@@ -201,30 +232,51 @@ def delete_stack(cf, stack_name):
         print(f"❌ Unexpected error waiting for stack delete: {e}")
 
 
+def process_bucket(s3, bucket, concurrency=CONCURRENCY_DEFAULT, verify=False):
+    # בדיקת קיום אחת (head_bucket) לכל באקט; empty_bucket/delete_bucket מניחים שהבאקט קיים
+    if bucket_exists(s3, bucket):
+        empty_bucket(s3, bucket, concurrency, verify)
+        delete_bucket(s3, bucket)
+    else:
+        print(f"⏭️ Skipping bucket '{bucket}' because it does not exist or is not accessible.")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Empty and delete S3 buckets and CloudFormation stacks.")
     parser.add_argument("--region", default=REGION_DEFAULT, help="AWS region (default: us-east-1)")
     parser.add_argument("--profile", help="AWS CLI profile name to use")
     parser.add_argument("--role-arn", help="ARN of role to assume (optional)")
     parser.add_argument("--role-session-name", default="admin-session", help="Role session name for STS assume_role")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY_DEFAULT,
+                        help=f"Parallel delete_objects calls per bucket (default: {CONCURRENCY_DEFAULT})")
+    parser.add_argument("--verify", action="store_true",
+                        help="List remaining versions/markers after emptying each bucket")
     args = parser.parse_args()
 
     try:
         session = create_session(region=args.region, profile=args.profile, role_arn=args.role_arn, role_session_name=args.role_session_name)
-        s3 = session.client("s3")
-        cf = session.client("cloudformation")
+        s3 = session.client("s3", config=BOTO_CONFIG)
+        cf = session.client("cloudformation", config=BOTO_CONFIG)
     except NoRegionError:
         raise RuntimeError("Region must be specified. Set REGION or AWS_DEFAULT_REGION.")
 
-    for b in BUCKETS:
-        if bucket_exists(s3, b):
-            empty_bucket(s3, b)
-            delete_bucket(s3, b)
-        else:
-            print(f"⏭️ Skipping bucket '{b}' because it does not exist or is not accessible.")
-
-    for stack in STACK_NAMES:
-        delete_stack(cf, stack)
+    # הבאקטים בלתי תלויים – מרוקנים ומוחקים את כולם במקביל (ה-client של boto3 thread-safe)
+    with ThreadPoolExecutor(max_workers=len(BUCKETS)) as executor:
+        futures = {executor.submit(process_bucket, s3, b, args.concurrency, args.verify): b for b in BUCKETS}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"❌ Processing bucket '{futures[fut]}' failed: {e}")
+
+    # גם ה-stacks בלתי תלויים – ה-waiters רצים במקביל, זמן הכולל ≈ המחיקה הארוכה ביותר
+    with ThreadPoolExecutor(max_workers=len(STACK_NAMES)) as executor:
+        futures = {executor.submit(delete_stack, cf, name): name for name in STACK_NAMES}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"❌ Deleting stack '{futures[fut]}' failed: {e}")
 
 
 if __name__ == "__main__":
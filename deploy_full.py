@@ -19,14 +19,21 @@ Usage examples:
 """
 import time
 import argparse
+import shlex
 import subprocess
 import sys
 import os
 import shutil
+import tempfile
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import json
 import boto3
-import toml
+try:
+    import tomllib  # Python 3.11+
+except ImportError:  # pragma: no cover
+    import tomli as tomllib
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # ---------- Local-only defaults ----------
@@ -34,13 +41,24 @@ FRONTEND_DIR: str = "frontend"
 UPLOAD_JS_PATH: Path = os.path.join(FRONTEND_DIR, "upload.js")
 PREFIX: str = "frontend/"
 SAMCONFIG_PATH: str = "samconfig.toml"
+BOTO_CONFIG = Config(
+    max_pool_connections=64,
+    retries={"max_attempts": 10, "mode": "adaptive"},
+    tcp_keepalive=True,
+)
 # ----------------------------------------
 
 
+def _resolve_exe(cmd):
+    """Resolve cmd[0] via PATH/PATHEXT (e.g. sam.cmd on Windows) so it can run without a shell."""
+    exe = shutil.which(cmd[0])
+    return [exe or cmd[0], *cmd[1:]]
+
+
 def run_cmd(cmd):
-    """Run a shell command and print it."""
+    """Run a command (no shell) and print it."""
     print(">", " ".join(cmd))
-    subprocess.check_call(" ".join(cmd), shell=True)
+    subprocess.check_call(_resolve_exe(cmd))
 
 
 def create_session(region, profile=None, role_arn=None, role_session_name="deploy-session"):
@@ -78,11 +96,12 @@ def recreate_bucket(s3_client, bucket, region):
     try:
         s3_client.head_bucket(Bucket=bucket)
         print(f"Bucket {bucket} exists. Deleting...")
-        # מחיקת כל האובייקטים
+        # מחיקת כל האובייקטים – קריאת delete_objects אחת לכל דף (עד 1000 מפתחות) במקום קריאה לכל אובייקט
         paginator = s3_client.get_paginator("list_objects_v2")
-        for page in paginator.paginate(Bucket=bucket):
-            for obj in page.get("Contents", []):
-                s3_client.delete_object(Bucket=bucket, Key=obj["Key"])
+        for page in paginator.paginate(Bucket=bucket, PaginationConfig={"PageSize": 1000}):
+            keys = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+            if keys:
+                s3_client.delete_objects(Bucket=bucket, Delete={"Objects": keys, "Quiet": True})
         # מחיקת הדלי עצמו
         s3_client.delete_bucket(Bucket=bucket)
         waiter = s3_client.get_waiter("bucket_not_exists")
@@ -115,7 +134,8 @@ def delete_stack_if_exists(cf_client, stack_name):
         cf_client.delete_stack(StackName=stack_name)
 
         waiter = cf_client.get_waiter("stack_delete_complete")
-        waiter.wait(StackName=stack_name)
+        # polling כל 6 שניות במקום 30 (ברירת המחדל), אותו timeout כולל של שעה
+        waiter.wait(StackName=stack_name, WaiterConfig={"Delay": 6, "MaxAttempts": 600})
         print(f"Stack {stack_name} deleted successfully.")
     except ClientError as e:
         if "does not exist" in str(e):
@@ -124,11 +144,9 @@ def delete_stack_if_exists(cf_client, stack_name):
             raise
 
 
-def check_iam_permissions(session):
+def check_iam_permissions(s3, cf):
     """Verify IAM permissions for CloudFormation and S3 by making simple API calls."""
     try:
-        cf = session.client("cloudformation")
-        s3 = session.client("s3")
         cf.describe_stacks()
         s3.list_buckets()
         print("IAM permissions check passed: able to call CloudFormation and S3 APIs.")
@@ -181,14 +199,18 @@ def get_stack_outputs(cf_client, stack_name):
 def create_base_prefixes(s3_client, bucket):
     """Create base prefixes (recordings/, summaries/, transcriptions/) as empty objects."""
     prefixes = ["recordings/", "summaries/", "transcriptions/"]
-    for p in prefixes:
-        key = p  # S3 "folder" key
+
+    def _put_prefix(key):  # S3 "folder" key
         try:
             s3_client.put_object(Bucket=bucket, Key=key)
             print(f"Created base prefix: s3://{bucket}/{key}")
         except ClientError as e:
             print(f"Failed to create prefix {key}: {e}")
 
+    # ה-prefixes נשמרים רק לנראות ב-console (ב-S3 אין תיקיות) – יוצרים את שלושתם במקביל
+    with ThreadPoolExecutor(max_workers=len(prefixes)) as executor:
+        list(executor.map(_put_prefix, prefixes))
+
 def check_bucket_notifications(s3_client, bucket):
     conf = s3_client.get_bucket_notification_configuration(Bucket=bucket)
     print("Bucket notification configuration:", json.dumps(conf, indent=2))
@@ -201,29 +223,36 @@ def patch_upload_js(upload_js_path, presign_url, summary_url, backup=True):
         print("upload.js not found at", upload_js_path)
         return False
 
-    with open(upload_js_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    new_lines = []
-    for line in lines:
-        if line.strip().startswith("const PRESIGN_ENDPOINT"):
-            new_lines.append(
-                f'const PRESIGN_ENDPOINT = isLocal ? "http://127.0.0.1:3000/presign" : "{presign_url}";\n'
-            )
-        elif line.strip().startswith("const SUMMARY_ENDPOINT"):
-            new_lines.append(
-                f'const SUMMARY_ENDPOINT = isLocal ? "http://127.0.0.1:3000/summary" : "{summary_url}";\n'
-            )
-        else:
-            new_lines.append(line)
-
-    if backup:
-        bak = upload_js_path + ".bak"
-        shutil.copy2(upload_js_path, bak)
-        print("Backup created:", bak)
-
-    with open(upload_js_path, "w", encoding="utf-8") as f:
-        f.writelines(new_lines)
+    # כתיבה שורה-שורה לקובץ זמני באותה תיקייה, ואז rename אטומי (בלי readlines)
+    tmp = tempfile.NamedTemporaryFile(
+        "w", dir=os.path.dirname(upload_js_path) or ".", suffix=".tmp", delete=False, encoding="utf-8"
+    )
+    try:
+        with tmp, open(upload_js_path, "r", encoding="utf-8") as src:
+            for line in src:
+                if line.strip().startswith("const PRESIGN_ENDPOINT"):
+                    line = f'const PRESIGN_ENDPOINT = isLocal ? "http://127.0.0.1:3000/presign" : "{presign_url}";\n'
+                elif line.strip().startswith("const SUMMARY_ENDPOINT"):
+                    line = f'const SUMMARY_ENDPOINT = isLocal ? "http://127.0.0.1:3000/summary" : "{summary_url}";\n'
+                tmp.write(line)
+
+        # NamedTemporaryFile נוצר עם 0600 – מעתיקים את ההרשאות של המקור לפני ההחלפה
+        shutil.copymode(upload_js_path, tmp.name)
+        if backup:
+            # hardlink (או העתקה) במקום rename: upload.js נשאר במקומו גם אם ההחלפה למטה נכשלת
+            bak = upload_js_path + ".bak"
+            if os.path.lexists(bak):
+                os.remove(bak)
+            try:
+                os.link(upload_js_path, bak)
+            except OSError:
+                shutil.copy2(upload_js_path, bak)
+            print("Backup created:", bak)
+        os.replace(tmp.name, upload_js_path)
+    except BaseException:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+        raise
 
     print("upload.js patched successfully.")
     return True
@@ -254,7 +283,7 @@ def upload_frontend(s3_client, bucket, frontend_dir, prefix="frontend/"):
         return False
 
     allowed_files = {"index.html", "upload.js", "font-loader.js", "redirect-index.html"}
-    uploaded = []
+    tasks = []
 
     for fname in allowed_files:
         local_path = os.path.join(frontend_dir, fname)
@@ -267,14 +296,19 @@ def upload_frontend(s3_client, bucket, frontend_dir, prefix="frontend/"):
         else:
             s3_key = prefix + fname
 
+        tasks.append((local_path, s3_key, guess_content_type(fname)))
+
+    def _upload(task):
+        local_path, s3_key, content_type = task
         print(f"Uploading {local_path} -> s3://{bucket}/{s3_key}")
-        s3_client.upload_file(
-            local_path,
-            bucket,
-            s3_key,
-            ExtraArgs={"ContentType": guess_content_type(fname)},
-        )
-        uploaded.append(s3_key)
+        s3_client.upload_file(local_path, bucket, s3_key, ExtraArgs={"ContentType": content_type})
+        return s3_key
+
+    # הקבצים בלתי תלויים – מעלים את כולם במקביל (ה-client של boto3 thread-safe)
+    uploaded = []
+    if tasks:
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            uploaded = list(executor.map(_upload, tasks))
 
     print(f"Uploaded {len(uploaded)} files: {uploaded}")
     return True
@@ -343,13 +377,15 @@ def get_bucket_website_url(s3_client, bucket):
 
 
 def get_values_from_samconfig(path=SAMCONFIG_PATH):
-    """Parse samconfig.toml and return key values."""
-    cfg = toml.load(path)
+    """Parse samconfig.toml once and return (stack_name, artifacts_bucket, region, parameter_overrides)."""
+    with open(path, "rb") as f:
+        cfg = tomllib.load(f)
     deploy_params = cfg["default"]["deploy"]["parameters"]
     stack_name = deploy_params["stack_name"]
     artifacts_bucket = deploy_params["s3_bucket"]
     region = deploy_params["region"]
-    return stack_name, artifacts_bucket, region
+    param_overrides = deploy_params.get("parameter_overrides", "")
+    return stack_name, artifacts_bucket, region, param_overrides
 
 def main():
     """
@@ -394,16 +430,12 @@ def main():
     args = parser.parse_args()
 
     # --- Load values from samconfig.toml ---
-    stack_name, artifacts_bucket, region_from_config = get_values_from_samconfig(SAMCONFIG_PATH)
+    stack_name, artifacts_bucket, region_from_config, param_overrides = get_values_from_samconfig(SAMCONFIG_PATH)
     region = args.region or region_from_config
 
-    # Extract InputBucketName from parameter_overrides
-    input_bucket = None
-    cfg = toml.load(SAMCONFIG_PATH)
-    param_overrides = cfg["default"]["deploy"]["parameters"].get("parameter_overrides", "")
-    for part in param_overrides.split():
-        if part.startswith("InputBucketName="):
-            input_bucket = part.split("=")[1].strip('"')
+    # Extract InputBucketName from parameter_overrides (shlex מטפל בערכים עם מרכאות/רווחים)
+    overrides = dict(part.split("=", 1) for part in shlex.split(param_overrides) if "=" in part)
+    input_bucket = overrides.get("InputBucketName", "").strip('"') or None
 
     if not input_bucket:
         print("Input bucket name not found in samconfig.toml parameter_overrides.")
@@ -411,11 +443,13 @@ def main():
 
     # --- Create boto3 session ---
     session = create_session(region=region, profile=args.profile, role_arn=args.role_arn)
-    s3 = session.client("s3")
-    cf = session.client("cloudformation")
+    s3 = session.client("s3", config=BOTO_CONFIG)
+    cf = session.client("cloudformation", config=BOTO_CONFIG)
+    # כל ה-clients נבנים פעם אחת כאן (טעינת מודל השירות + credentials) ומועברים הלאה
+    lambda_client = session.client("lambda", config=BOTO_CONFIG)
 
     # Verify IAM permissions
-    check_iam_permissions(session)
+    check_iam_permissions(s3, cf)
 
     # Force delete stack if it already exists (clean redeploy)
     delete_stack_if_exists(cf, stack_name)
@@ -462,7 +496,6 @@ def main():
     print("Deployment complete. Frontend should be available via S3 website endpoint or CloudFront if configured.")
 
     # 7) Invoke Lambda once to ensure log group exists
-    lambda_client = session.client("lambda")
     voice_fn_arn = outputs.get("VoiceAgentFunctionArn")
     if voice_fn_arn:
         print("Invoking Lambda once to create log group...")
@@ -493,11 +526,11 @@ def main():
         # 8) Tail logs live
         log_group_name = f"/aws/lambda/{voice_fn_arn.split(':')[-1]}"
         print(f"Starting live log tail for {log_group_name}...")
-        subprocess.Popen([
+        subprocess.Popen(_resolve_exe([
             "aws", "logs", "tail", log_group_name,
             "--follow", "--region", region,
             "--profile", args.profile or "default"
-        ])
+        ]))
 
 
 if __name__ == "__main__":
@@ -13,25 +13,50 @@ or
 $env:AWS_PROFILE = "admin-manager"
 python save_to_secrets.py --env .env --secret-name my/gemini/all-env --region us-east-1 --all
 
+or, to read secrets back (BatchGetSecretValue, up to 20 names per call):
+python save_to_secrets.py --dump-secrets my/gemini/all-env,my/other/secret --region us-east-1
+
+or, to force-delete every secret whose name starts with a prefix:
+python save_to_secrets.py --delete-prefix my/gemini/ --region us-east-1
+
 if you want to delete the env profile, you can use the following command:
     Remove-Item Env:AWS_PROFILE
 
 Options:
   --delete-timeout SECONDS   How long to wait for deletion to complete (default 120)
+  --dump-secrets NAMES       Comma-separated secret names/ARNs to print as JSON (needs
+                             secretsmanager:BatchGetSecretValue, falls back to GetSecretValue)
+  --delete-prefix PREFIX     Force-delete all secrets whose name starts with PREFIX (10 in parallel)
   --quiet                    Minimal output (only success/failure)
   --verbose                  Verbose debug output
 """
 import argparse
 import json
+import functools
 import os
+import re
 import time
-from datetime import datetime, timezone, timedelta
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import boto3
-from botocore.exceptions import ClientError
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:  # orjson אופציונלי מחוץ ל-layer
+    def _dumps(obj):
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    _loads = json.loads
+from botocore.exceptions import ClientError, WaiterError
+from botocore.waiter import WaiterModel, create_waiter_with_client
 
 LOG = logging.getLogger("save_to_secrets")
 
+@functools.lru_cache(maxsize=None)
+def get_secrets_client(region):
+    """Secrets Manager client אחד לכל region (session יחיד לתהליך)."""
+    return boto3.session.Session().client("secretsmanager", region_name=region)
+
 def setup_logging(quiet=False, verbose=False):
     handler = logging.StreamHandler()
     if quiet:
@@ -47,29 +72,29 @@ def setup_logging(quiet=False, verbose=False):
     if not LOG.handlers:
         LOG.addHandler(handler)
 
-def read_dotenv(path):
-    env = {}
+# KEY=VALUE בשורה; ערך במרכאות כפולות/בודדות או ערך חשוף. שורות ריקות והערות (#) לא מתאימות
+_ENV_RE = re.compile(
+    r"""^[ \t]*([^#=\s][^=\n]*?)[ \t]*=[ \t]*(?:"([^"\n]*)"|'([^'\n]*)'|(.*?))[ \t]*$""",
+    re.M,
+)
+
+def read_dotenv(path, wanted=None):
+    """Parse KEY=VALUE pairs (last occurrence wins); if `wanted` is given, only those keys are kept."""
     with open(path, "r", encoding="utf-8") as f:
-        for raw in f:
-            line = raw.strip()
-            if not line or line.startswith("#"):
-                continue
-            if "=" in line:
-                k, v = line.split("=", 1)
-                k = k.strip()
-                v = v.strip().strip('"').strip("'")
-                env[k] = v
+        data = f.read()
+    wanted = set(wanted) if wanted is not None else None
+    env = {}
+    # סורקים עד סוף הקובץ גם עם wanted: מפתח שמוגדר שוב בהמשך ה-.env דורס את הערך הקודם
+    for m in _ENV_RE.finditer(data):
+        k = m.group(1)
+        if wanted is not None and k not in wanted:
+            continue
+        env[k] = next(g for g in m.group(2, 3, 4) if g is not None)
     return env
 
-def secret_exists(client, secret_name):
-    try:
-        client.describe_secret(SecretId=secret_name)
-        return True
-    except ClientError as e:
-        code = e.response.get("Error", {}).get("Code", "")
-        if code in ("ResourceNotFoundException", "InvalidRequestException"):
-            return False
-        raise
+def serialize_payload(payload):
+    """JSON קומפקטי (בלי רווחים) ל-SecretString; orjson כשזמין."""
+    return _dumps(payload).decode("utf-8")
 
 def force_delete_secret(client, secret_name):
     try:
@@ -82,26 +107,50 @@ def force_delete_secret(client, secret_name):
         if code == "InvalidRequestException" and "scheduled for deletion" in msg:
             LOG.info("delete: already scheduled for deletion: %s", secret_name)
             return True
+        if code == "ResourceNotFoundException":
+            LOG.debug("secret does not exist: %s", secret_name)
+            return False
         LOG.error("delete: failed for %s: %s", secret_name, e)
         raise
 
-def wait_until_secret_gone(client, secret_name, timeout_seconds=120, poll_interval=2):
-    deadline = datetime.now(timezone.utc) + timedelta(seconds=timeout_seconds)
-    while True:
-        try:
-            client.describe_secret(SecretId=secret_name)
-            # still exists
-            if datetime.now(timezone.utc) > deadline:
-                raise TimeoutError(f"Timed out waiting for secret {secret_name} to be removed (timeout {timeout_seconds}s)")
-            LOG.debug("poll: secret still exists, sleeping %ss", poll_interval)
-            time.sleep(poll_interval)
-        except ClientError as e:
-            code = e.response.get("Error", {}).get("Code", "")
-            if code in ("ResourceNotFoundException", "InvalidRequestException"):
-                LOG.info("delete: confirmed removed: %s", secret_name)
-                return
-            LOG.error("poll: describe failed: %s", e)
-            raise
+# waiter מוגדר מראש: DescribeSecret עד שהסוד נעלם (botocore מנהל את ה-polling וה-retries)
+_SECRET_GONE_WAITER_NAME = "SecretGone"
+
+
+def _secret_gone_waiter_model(delay, max_attempts):
+    return WaiterModel({
+        "version": 2,
+        "waiters": {
+            _SECRET_GONE_WAITER_NAME: {
+                "operation": "DescribeSecret",
+                "delay": delay,
+                "maxAttempts": max_attempts,
+                "acceptors": [
+                    {"state": "success", "matcher": "error", "expected": "ResourceNotFoundException"},
+                    {"state": "success", "matcher": "error", "expected": "InvalidRequestException"},
+                    {"state": "retry", "matcher": "status", "expected": 200},
+                ],
+            }
+        },
+    })
+
+
+@functools.lru_cache(maxsize=None)
+def _get_secret_gone_waiter(client, delay, max_attempts):
+    return create_waiter_with_client(_SECRET_GONE_WAITER_NAME, _secret_gone_waiter_model(delay, max_attempts), client)
+
+
+def wait_until_secret_gone(client, secret_name, timeout_seconds=120, poll_interval=1):
+    max_attempts = max(1, int(timeout_seconds // poll_interval))
+    waiter = _get_secret_gone_waiter(client, poll_interval, max_attempts)
+    try:
+        waiter.wait(SecretId=secret_name)
+    except WaiterError as e:
+        if "Max attempts exceeded" in str(e):
+            raise TimeoutError(f"Timed out waiting for secret {secret_name} to be removed (timeout {timeout_seconds}s)") from e
+        LOG.error("poll: describe failed: %s", e)
+        raise
+    LOG.info("delete: confirmed removed: %s", secret_name)
 
 def create_secret(client, secret_name, secret_string, description=None):
     try:
@@ -111,38 +160,82 @@ def create_secret(client, secret_name, secret_string, description=None):
         LOG.error("create: failed for %s: %s", secret_name, e)
         raise
 
-def ensure_recreate_secret(client, secret_name, secret_string, description=None, delete_timeout=120):
-    try:
-        exists = secret_exists(client, secret_name)
-    except ClientError as e:
-        LOG.error("existence check failed: %s", e)
-        raise
+BATCH_GET_MAX_SECRETS = 20
+
+def batch_fetch(client, names):
+    """Return {Name: SecretString} using batch_get_secret_value in chunks of 20 names."""
+    result = {}
+    for i in range(0, len(names), BATCH_GET_MAX_SECRETS):
+        chunk = names[i:i + BATCH_GET_MAX_SECRETS]
+        try:
+            resp = client.batch_get_secret_value(SecretIdList=chunk)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code", "") != "AccessDeniedException":
+                raise
+            # אין הרשאת BatchGetSecretValue – חוזרים לקריאה אחת לכל סוד
+            LOG.debug("batch_get_secret_value denied, falling back to get_secret_value")
+            # כמו ב-batch: סוד חסר/חסום נרשם ב-log ושאר הסודות ממשיכים; המפתח הוא Name גם כשנשלח ARN
+            for name in chunk:
+                try:
+                    sv = client.get_secret_value(SecretId=name)
+                except ClientError as e:
+                    err = e.response.get("Error", {})
+                    LOG.warning("batch_get: %s: %s %s", name, err.get("Code"), err.get("Message", ""))
+                    continue
+                result[sv["Name"]] = sv.get("SecretString")
+            continue
+        for sv in resp.get("SecretValues", []):
+            result[sv["Name"]] = sv.get("SecretString")
+        for err in resp.get("Errors", []):
+            LOG.warning("batch_get: %s: %s %s", err.get("SecretId"), err.get("ErrorCode"), err.get("Message", ""))
+    return result
+
+DELETE_PREFIX_WORKERS = 10
 
-    if exists:
-        force_delete_secret(client, secret_name)
+def delete_secrets_by_prefix(client, prefix):
+    """Force-delete every secret whose name starts with `prefix`; returns the deleted names."""
+    paginator = client.get_paginator("list_secrets")
+    names = [
+        sec["Name"]
+        for page in paginator.paginate(Filters=[{"Key": "name", "Values": [prefix]}])
+        for sec in page.get("SecretList", [])
+        if sec["Name"].startswith(prefix)  # פילטר name של list_secrets אינו case-sensitive
+    ]
+    if not names:
+        LOG.info("delete-prefix: no secrets match %s", prefix)
+        return []
+    with ThreadPoolExecutor(max_workers=min(DELETE_PREFIX_WORKERS, len(names))) as executor:
+        results = list(executor.map(lambda n: force_delete_secret(client, n), names))
+    deleted = [n for n, ok in zip(names, results) if ok]
+    LOG.info("delete-prefix: %d/%d secrets deleted under %s", len(deleted), len(names), prefix)
+    return deleted
+
+CREATE_RETRY_DELAYS = (0.1, 0.2, 0.5, 1, 2)
+
+def ensure_recreate_secret(client, secret_name, secret_string, description=None, delete_timeout=120):
+    # delete_secret ישירות (בלי describe מקדים) – ResourceNotFoundException פירושו שאין מה למחוק
+    if force_delete_secret(client, secret_name):
         wait_until_secret_gone(client, secret_name, timeout_seconds=delete_timeout)
-    else:
-        LOG.debug("secret does not exist: %s", secret_name)
 
-    try:
-        create_secret(client, secret_name, secret_string, description=description)
-    except ClientError as e:
-        msg = str(e)
-        code = e.response.get("Error", {}).get("Code", "")
-        if code == "InvalidRequestException" and "scheduled for deletion" in msg:
-            LOG.info("create: name reserved, polling until free...")
-            wait_until_secret_gone(client, secret_name, timeout_seconds=delete_timeout)
-            create_secret(client, secret_name, secret_string, description=description)
-        else:
-            raise
+    # כבר חיכינו למחיקה, כך שחלון ה-race קצר – כמה retries קצרים במקום poll מלא נוסף
+    for delay in CREATE_RETRY_DELAYS:
+        try:
+            return create_secret(client, secret_name, secret_string, description=description)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code", "")
+            if not (code == "InvalidRequestException" and "scheduled for deletion" in str(e)):
+                raise
+            LOG.info("create: name still reserved, retrying in %ss...", delay)
+            time.sleep(delay)
+    create_secret(client, secret_name, secret_string, description=description)
 
 def build_payload_from_env(env_path, all_keys=False, sensitive_keys="GEMINI_API_KEY"):
     if not os.path.isfile(env_path):
         raise FileNotFoundError(env_path)
-    env = read_dotenv(env_path)
     if all_keys:
-        return env
+        return read_dotenv(env_path)
     keys = [k.strip() for k in sensitive_keys.split(",") if k.strip()]
+    env = read_dotenv(env_path, wanted=keys)
     return {k: env[k] for k in keys if k in env}
 
 def main():
@@ -150,7 +243,9 @@ def main():
     group = parser.add_mutually_exclusive_group(required=True)
     group.add_argument("--env", help="Path to .env file (KEY=VALUE)")
     group.add_argument("--secrets-file", help="Path to a JSON file (e.g., secrets_gemini.json) to upload")
-    parser.add_argument("--secret-name", required=True, help="Secrets Manager secret name (e.g. my/gemini/credentials)")
+    group.add_argument("--dump-secrets", help="Comma-separated secret names/ARNs to read (batch) and print as JSON")
+    group.add_argument("--delete-prefix", help="Force-delete all secrets whose name starts with this prefix")
+    parser.add_argument("--secret-name", help="Secrets Manager secret name (e.g. my/gemini/credentials); required for --env/--secrets-file")
     parser.add_argument("--region", default="us-east-1", help="AWS region")
     parser.add_argument("--all", action="store_true", help="Store entire .env as JSON (default: only sensitive keys)")
     parser.add_argument("--sensitive-keys", default="GEMINI_API_KEY", help="Comma-separated keys to treat as sensitive (default: GEMINI_API_KEY)")
@@ -159,15 +254,28 @@ def main():
     parser.add_argument("--verbose", action="store_true", help="Verbose debug output")
     args = parser.parse_args()
 
+    if not (args.dump_secrets or args.delete_prefix) and not args.secret_name:
+        parser.error("--secret-name is required with --env/--secrets-file")
+
     setup_logging(quiet=args.quiet, verbose=args.verbose)
 
     try:
+        if args.dump_secrets:
+            names = [n.strip() for n in args.dump_secrets.split(",") if n.strip()]
+            secrets = batch_fetch(get_secrets_client(args.region), names)
+            print(json.dumps(secrets, ensure_ascii=False, indent=2))
+            return
+
+        if args.delete_prefix:
+            delete_secrets_by_prefix(get_secrets_client(args.region), args.delete_prefix)
+            return
+
         if args.secrets_file:
             if not os.path.isfile(args.secrets_file):
                 LOG.error("secrets file not found: %s", args.secrets_file)
                 return
-            with open(args.secrets_file, "r", encoding="utf-8") as sf:
-                payload = json.load(sf)
+            with open(args.secrets_file, "rb") as sf:
+                payload = _loads(sf.read())
         else:
             try:
                 payload = build_payload_from_env(args.env, all_keys=args.all, sensitive_keys=args.sensitive_keys)
@@ -179,8 +287,8 @@ def main():
             LOG.warning("payload empty — nothing to store")
             return
 
-        secret_string = json.dumps(payload, ensure_ascii=False)
-        client = boto3.client("secretsmanager", region_name=args.region)
+        secret_string = serialize_payload(payload)
+        client = get_secrets_client(args.region)
 
         ensure_recreate_secret(client, args.secret_name, secret_string, description="Created from .env by save_to_secrets.py", delete_timeout=args.delete_timeout)
         LOG.info("done")
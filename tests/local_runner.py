@@ -5,9 +5,18 @@ Local runner for Serverless Gemini Agent
 - Real cloud mode: upload a local audio file to S3 and optionally invoke deployed Lambda,
   or wait for the summary file to appear in S3 (polling).
 Usage:
-  # Mock run (default)
+  # Mock run (default); from the project root, `python -m tests.local_runner` also works
   python tests/local_runner.py
 
+  # Mock run against moto's in-memory AWS backend (pip install "moto>=5")
+  USE_MOTO=true python tests/local_runner.py
+
+  # Mock run against the chunked pipeline handler (backend/handler2_0.py) instead of backend/handler.py
+  LOCAL_HANDLER=handler2_0 python tests/local_runner.py
+
+  # Mock sweep over several object keys, one process per scenario
+  MOCK_AUDIO_KEYS=audio/a.m4a,audio/b.mp3,recordings/c.wav python tests/local_runner.py
+
   # Real cloud run (upload local file and wait for summary)
   REAL_CLOUD=true AUDIO_PATH=/path/to/audio.wav python tests/local_runner.py
 
@@ -16,25 +25,76 @@ Usage:
 """
 
 import os
+import io
+import contextlib
+import stat
+import functools
+import importlib.util
 import json
+import logging
+import mmap
 import time
+import types
 import urllib.parse
 import sys
 
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError, WaiterError
+from botocore.stub import ANY, Stubber
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from unittest import mock
 from dotenv import load_dotenv
 from pathlib import Path
 
-load_dotenv(dotenv_path=Path(__file__).resolve().parents[1] / ".env")
+# resolve() פעם אחת; כל הנתיבים של ה-runner נגזרים מכאן
+_TESTS_DIR = Path(__file__).resolve().parent
+PROJECT_ROOT = _TESTS_DIR.parent
+_ENV_PATH = PROJECT_ROOT / ".env"
+
+load_dotenv(dotenv_path=_ENV_PATH)
+
+
+try:
+    import orjson
+    _dumps = orjson.dumps
+
+    def _dumps_pretty(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode("utf-8")
 
+    def _dumps_pretty(obj):
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
 
-# Ensure project root is importable
-PROJECT_ROOT = Path(__file__).resolve().parents[1]
-sys.path.insert(0, str(PROJECT_ROOT))
+
+def print_json(obj):
+    """Pretty-print a handler result as UTF-8 straight to stdout (one write)."""
+    data = _dumps_pretty(obj) + b"\n"
+    buffer = getattr(sys.stdout, "buffer", None)
+    if buffer is None:  # stdout מוחלף (למשל redirect_stdout ל-StringIO)
+        sys.stdout.write(data.decode("utf-8"))
+        return
+    sys.stdout.flush()
+    buffer.write(data)
+    buffer.flush()
+
+
+# הודעות ה-mocks ב-DEBUG (פורמט עצל – המחרוזת לא נבנית אם הרמה כבויה); LOG_LEVEL=DEBUG כדי לראות אותן
+_log = logging.getLogger("local_runner")
+
+# Ensure project root is importable. `python -m tests.local_runner` from the project root already has it
+# on sys.path; only a direct `python tests/local_runner.py` run needs the insert.
+if importlib.util.find_spec("backend") is None:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+# Handler under test in the S3 flow: "handler" (backend/handler.py) or "handler2_0" (backend/handler2_0.py)
+LOCAL_HANDLER = os.environ.get("LOCAL_HANDLER", "handler")
 
 # Import modules under test (these are your backend handlers)
 try:
-    from backend import handler as voice_handler_module
+    voice_handler_module = importlib.import_module(f"backend.{LOCAL_HANDLER}")
     from backend import presign_handler as presign_module
 except Exception as e:
     print("ERROR: Could not import backend modules. Check project structure.")
@@ -67,96 +127,131 @@ AUDIO_PATH = Path(AUDIO_PATH_ENV) if AUDIO_PATH_ENV else None
 # Optionally hardcode a path for quick local runs (comment out in production)
 # AUDIO_PATH = Path(r"C:\Users\rened\OneDrive\מסמכים\Agent_project_gemmini\user_recording_123.m4a")
 
+# Mock mode backend: USE_MOTO=true runs S3/Transcribe through moto (test-only dependency) instead of the in-memory mocks
+USE_MOTO = str_to_bool(os.environ.get("USE_MOTO"), default=False)
+
 INVOKE_LAMBDA = str_to_bool(os.environ.get("INVOKE_LAMBDA"), default=False)
 LAMBDA_NAME = os.environ.get("LAMBDA_NAME", None)
 
 SUMMARY_POLL_TIMEOUT = int(os.environ.get("SUMMARY_POLL_TIMEOUT", "300"))
 SUMMARY_POLL_INTERVAL = int(os.environ.get("SUMMARY_POLL_INTERVAL", "5"))
 
+# handler2_0 בודק את אורך האודיו עם ffprobe; במצב mock האודיו ריק, לכן האורך נקבע כאן (ברירת מחדל: קובץ קצר, job יחיד)
+MOCK_AUDIO_DURATION_MS = int(os.environ.get("MOCK_AUDIO_DURATION_MS", "30000"))
+
 # --- Validation helper (call before real-cloud flow) ---
+# stat() אחד ל-AUDIO_PATH: בדיקת קיום + גודל הקובץ לאירוע S3 (מתמלא ב-validate_real_cloud_config)
+AUDIO_STAT = None
+
 def validate_real_cloud_config():
+    global AUDIO_STAT
     if REAL_CLOUD:
         if not AUDIO_PATH:
             raise ValueError("REAL_CLOUD is True but AUDIO_PATH is not set. Set AUDIO_PATH env var or update .env.")
-        if not AUDIO_PATH.exists() or not AUDIO_PATH.is_file():
+        try:
+            AUDIO_STAT = AUDIO_PATH.stat()
+        except OSError:
+            AUDIO_STAT = None
+        if AUDIO_STAT is None or not stat.S_ISREG(AUDIO_STAT.st_mode):
             raise FileNotFoundError(f"AUDIO_PATH not found: {AUDIO_PATH}\n"
                                     "Check that the path is correct, accessible, and that you run the script in the same shell where the env var is set.")
         if not INPUT_BUCKET_NAME:
             raise ValueError("INPUT_BUCKET_NAME must be set for REAL_CLOUD runs.")
 
 
-# --- Sample transcript JSON used by mocks ---
-SAMPLE_TRANSCRIBE_JSON = {
-    "results": {
-        "transcripts": [
-            {"transcript": "This is a sample transcript text produced for local testing. The meeting objective was to plan the Q1 roadmap."}
-        ]
-    }
-}
+# --- Fixtures used by mocks (tests/fixtures/, shaped like the real service responses) ---
+# נקראים פעם אחת בזמן import; כל קריאה ב-mock מחזירה את אותם bytes/טקסט
+FIXTURES_DIR = _TESTS_DIR / "fixtures"
+_SAMPLE_TRANSCRIBE_BYTES = (FIXTURES_DIR / "transcribe_output.json").read_bytes()
+SAMPLE_TRANSCRIBE_JSON = json.loads(_SAMPLE_TRANSCRIBE_BYTES)
+_MOCK_GEMINI_TEXT = (FIXTURES_DIR / "gemini_summary.json").read_text(encoding="utf-8")
+# תוצאת generate_content אחת משותפת לכל הקריאות (text כמו ב-SDK, output_text למסלול ה-legacy)
+_MOCK_GEMINI_RESULT = types.SimpleNamespace(text=_MOCK_GEMINI_TEXT, output_text=_MOCK_GEMINI_TEXT)
 
 
 # --- Mock implementations for boto3 clients (same as before) ---
-class MockBody:
-    def __init__(self, data_bytes):
-        self._data = data_bytes
+# גופי get_object הם io.BytesIO – read(size)/seek/context manager כמו StreamingBody אמיתי
+@functools.lru_cache(maxsize=1024)
+def _presigned_base(bucket, key):
+    # ה-URL (בלי expires_in) קבוע לכל bucket/key – מחושב פעם אחת
+    return f"https://mock-s3/{bucket}/{urllib.parse.quote(key)}"
 
-    def read(self):
-        return self._data
+
+def _s3_error(code, operation_name, key):
+    return ClientError({"Error": {"Code": code, "Message": f"MockS3Client: Key not found: {key}"}}, operation_name)
 
 
 class MockS3Client:
+    # handler.py תופס שגיאות דרך s3_client.exceptions.ClientError, כמו ב-client אמיתי
+    exceptions = types.SimpleNamespace(ClientError=ClientError)
+
     def __init__(self, bucket_name):
         self.bucket = bucket_name
-        self.storage = {}  # in-memory store for put_object calls
+        self.storage = {}  # in-memory store for put_object calls (raw bytes, as S3 stores them)
 
     def get_object(self, Bucket, Key):
-        if Key.endswith(".json"):
-            body = json.dumps(SAMPLE_TRANSCRIBE_JSON).encode("utf-8")
-            return {"Body": MockBody(body)}
-        if Key.endswith(".m4a") or Key.endswith(".mp3") or Key.endswith(".wav"):
-            return {"ResponseMetadata": {"HTTPStatusCode": 200}}
         if Key in self.storage:
-            return {"Body": MockBody(self.storage[Key].encode("utf-8"))}
-        raise FileNotFoundError(f"MockS3Client: Key not found: {Key}")
+            return {"Body": io.BytesIO(self.storage[Key])}
+        raise _s3_error("NoSuchKey", "GetObject", Key)
 
     def put_object(self, Bucket, Key, Body, ContentType="application/json"):
-        self.storage[Key] = Body.decode("utf-8") if isinstance(Body, (bytes, bytearray)) else str(Body)
-        print(f"[MockS3] put_object -> Bucket: {Bucket}, Key: {Key}, ContentType: {ContentType}")
+        self.storage[Key] = bytes(Body) if isinstance(Body, (bytes, bytearray, memoryview, mmap.mmap)) else str(Body).encode("utf-8")
+        _log.debug("[MockS3] put_object -> Bucket: %s, Key: %s, ContentType: %s", Bucket, Key, ContentType)
         return {"ResponseMetadata": {"HTTPStatusCode": 200}}
 
     def head_object(self, Bucket, Key):
-        return {"Metadata": {}}
+        # כמו HEAD אמיתי: מפתח חסר מחזיר 404 (בלי גוף שגיאה)
+        if Key not in self.storage:
+            raise _s3_error("404", "HeadObject", Key)
+        return {"Metadata": {}, "ContentLength": len(self.storage[Key])}
+
+    def download_file(self, Bucket, Key, Filename, ExtraArgs=None, Callback=None, Config=None):
+        Path(Filename).write_bytes(self.get_object(Bucket=Bucket, Key=Key)["Body"].getvalue())
 
     def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
-        bucket = Params.get("Bucket")
-        key = Params.get("Key")
-        return f"https://mock-s3/{bucket}/{urllib.parse.quote(key)}?expires_in={ExpiresIn}"
-
-
-class MockTranscribeClient:
-    def __init__(self, transcript_key):
-        self.transcript_key = transcript_key
-        self.started_jobs = {}
-
-    def start_transcription_job(self, TranscriptionJobName, Media, MediaFormat, LanguageCode, OutputBucketName):
-        transcript_uri = f"https://s3.amazonaws.com/{OutputBucketName}/{self.transcript_key}.json"
-        job = {
-            "TranscriptionJobName": TranscriptionJobName,
-            "Media": Media,
-            "MediaFormat": MediaFormat,
-            "LanguageCode": LanguageCode,
-            "OutputBucketName": OutputBucketName,
-            "TranscriptionJobStatus": "COMPLETED",
-            "Transcript": {"TranscriptFileUri": transcript_uri},
-        }
-        self.started_jobs[TranscriptionJobName] = job
-        print(f"[MockTranscribe] start_transcription_job -> {TranscriptionJobName}")
-
-    def get_transcription_job(self, TranscriptionJobName):
-        job = self.started_jobs.get(TranscriptionJobName)
-        if not job:
-            return {"TranscriptionJob": {"TranscriptionJobStatus": "FAILED", "FailureReason": "Job not found"}}
-        return {"TranscriptionJob": job}
+        return f"{_presigned_base(Params.get('Bucket'), Params.get('Key'))}?expires_in={ExpiresIn}"
+
+
+def stubbed_transcribe_client(s3):
+    """
+    Real boto3 Transcribe client with a botocore Stubber attached: no HTTP, requests and responses are
+    validated against the service model. Responses are queued per run (queue_transcribe_job); when a
+    job is reported COMPLETED the fixture transcript is written to its OutputBucketName/OutputKey in `s3`,
+    the way the real service delivers its output. Returns (client, stubber).
+    """
+    client = _SESSION.client("transcribe", region_name=TRANSCRIBE_REGION)
+    outputs = {}  # job name -> (bucket, key) מתוך start_transcription_job
+
+    def _record_output(params, **kwargs):
+        outputs[params["TranscriptionJobName"]] = (params["OutputBucketName"], params["OutputKey"])
+
+    def _deliver_output(params, **kwargs):
+        bucket, key = outputs.pop(params["TranscriptionJobName"])
+        s3.put_object(Bucket=bucket, Key=key, Body=_SAMPLE_TRANSCRIBE_BYTES)
+
+    client.meta.events.register("before-parameter-build.transcribe.StartTranscriptionJob", _record_output)
+    client.meta.events.register("before-parameter-build.transcribe.GetTranscriptionJob", _deliver_output)
+    stub = Stubber(client)
+    stub.activate()
+    return client, stub
+
+
+def queue_transcribe_job(stub):
+    """Queue one start_transcription_job and a COMPLETED get_transcription_job (one Transcribe job per run)."""
+    job = {"TranscriptionJobName": "local-mock-job", "TranscriptionJobStatus": "COMPLETED"}
+    stub.add_response(
+        "start_transcription_job",
+        {"TranscriptionJob": {**job, "TranscriptionJobStatus": "IN_PROGRESS"}},
+        {
+            "TranscriptionJobName": ANY,
+            "Media": ANY,
+            "MediaFormat": ANY,
+            "LanguageCode": ANY,
+            "OutputBucketName": ANY,
+            "OutputKey": ANY,
+        },
+    )
+    stub.add_response("get_transcription_job", {"TranscriptionJob": job}, {"TranscriptionJobName": ANY})
 
 
 class MockGeminiClient:
@@ -164,30 +259,41 @@ class MockGeminiClient:
         self.api_key = api_key
 
     class models:
-        @staticmethod
-        def generate(model, input):
-            class Result:
-                def __init__(self, text):
-                    self.output_text = text
-            summary_text = (
-                "• Summary (mock): Meeting planned Q1 roadmap.\n"
-                "• Key point 1: Priorities set.\n"
-                "• Key point 2: Owners assigned.\n"
-                "• Key point 3: Deadlines discussed.\n"
-                "• Key point 4: Follow-ups scheduled.\n\n"
-                "Answer: The meeting objective was to plan the Q1 roadmap."
-            )
-            return Result(summary_text)
-
-
-def mock_boto3_client_factory(bucket_name, transcript_key):
-    def _client(service_name, *args, **kwargs):
-        if service_name == "s3":
-            return MockS3Client(bucket_name)
-        if service_name == "transcribe":
-            return MockTranscribeClient(transcript_key)
-        raise ValueError(f"Mock boto3 client for service '{service_name}' is not implemented.")
-    return _client
+        generate_content = staticmethod(lambda model, contents, config=None: _MOCK_GEMINI_RESULT)
+
+
+MOTO_CONFIG = {"core": {"reset_boto3_session": False}}
+
+
+def moto_backend_clients(bucket_name, audio_key):
+    """
+    Real boto3 S3 client inside an active moto mock_aws() context, with the bucket and the audio object seeded.
+    Transcribe stays on the Stubber, which writes its output into the moto bucket. Returns (s3, transcribe, stubber).
+    """
+    # Session חדש: moto נרשם ב-handlers של botocore רק ל-sessions שנוצרו אחרי ה-import שלו
+    session = boto3.session.Session()
+    s3 = session.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket=bucket_name)
+    s3.put_object(Bucket=bucket_name, Key=audio_key, Body=b"")
+    return (s3, *stubbed_transcribe_client(s3))
+
+
+MOCK_AUDIO_KEY = "audio/user_recording_123.m4a"
+# Mock mode scenario sweep: MOCK_AUDIO_KEYS="audio/a.m4a,audio/b.mp3,recordings/c.wav"
+MOCK_AUDIO_KEYS = [k.strip() for k in os.environ.get("MOCK_AUDIO_KEYS", "").split(",") if k.strip()]
+
+
+@functools.lru_cache(maxsize=None)
+def mock_clients(bucket_name, audio_key):
+    """
+    (s3, transcribe, stubber) for mock mode, built once per process and shared by the presign and S3-flow runs
+    (the equivalent of a session-scoped fixture): moto-backed S3 when USE_MOTO, otherwise the in-memory mock.
+    """
+    if USE_MOTO:
+        return moto_backend_clients(bucket_name, audio_key)
+    s3 = MockS3Client(bucket_name)
+    s3.put_object(Bucket=bucket_name, Key=audio_key, Body=b"")
+    return (s3, *stubbed_transcribe_client(s3))
 
 
 def mock_genai_client_factory():
@@ -197,6 +303,34 @@ def mock_genai_client_factory():
 
 
 # --- Real AWS helpers (used when REAL_CLOUD=True) ---
+# multipart במקביל לקבצי אודיו גדולים (ברירת המחדל: סף 8MB)
+_UPLOAD_CFG = TransferConfig(
+    multipart_threshold=5 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True,
+)
+
+# Session + clients נבנים פעם אחת לתהליך (טעינת מודל השירות ושרשרת ה-credentials יקרות)
+_SESSION = boto3.session.Session()
+_s3 = None
+_lambda = None
+
+
+def get_s3():
+    global _s3
+    if _s3 is None:
+        _s3 = _SESSION.client("s3")
+    return _s3
+
+
+def get_lambda():
+    global _lambda
+    if _lambda is None:
+        _lambda = _SESSION.client("lambda")
+    return _lambda
+
+
 def upload_file_to_s3(local_path: str, bucket: str, key: str, s3_client):
     """
     Upload a local file to S3 using the provided boto3 s3_client.
@@ -206,7 +340,7 @@ def upload_file_to_s3(local_path: str, bucket: str, key: str, s3_client):
         raise FileNotFoundError(f"Local audio file not found: {local_path}")
     print(f"[Upload] Uploading {local_path} -> s3://{bucket}/{key}")
     # Use upload_file for streaming large files
-    s3_client.upload_file(local_path, bucket, key)
+    s3_client.upload_file(local_path, bucket, key, Config=_UPLOAD_CFG)
     s3_uri = f"s3://{bucket}/{key}"
     print(f"[Upload] Completed: {s3_uri}")
     return key, s3_uri
@@ -216,20 +350,24 @@ def wait_for_summary_in_s3(bucket: str, original_key: str, s3_client, timeout: i
     """
     Poll S3 for the summary file written by the Lambda.
     Summary key convention: {output_prefix}{base_name}.summary.json
+    Waiting uses the object_exists waiter (HEAD requests only); the body is fetched once when it exists.
     """
     base_name = original_key.split("/")[-1]
     summary_key = f"{output_prefix}{base_name}.summary.json"
     print(f"[Poll] Waiting for summary at s3://{bucket}/{summary_key} (timeout {timeout}s)...")
-    start = time.time()
-    while time.time() - start < timeout:
-        try:
-            obj = s3_client.get_object(Bucket=bucket, Key=summary_key)
-            body = obj["Body"].read().decode("utf-8")
-            print(f"[Poll] Summary found: s3://{bucket}/{summary_key}")
-            return summary_key, body
-        except Exception:
-            time.sleep(interval)
-    raise TimeoutError(f"Summary not found within {timeout} seconds: s3://{bucket}/{summary_key}")
+    waiter = s3_client.get_waiter("object_exists")
+    try:
+        waiter.wait(
+            Bucket=bucket,
+            Key=summary_key,
+            WaiterConfig={"Delay": interval, "MaxAttempts": max(1, timeout // interval)},
+        )
+    except WaiterError as e:
+        raise TimeoutError(f"Summary not found within {timeout} seconds: s3://{bucket}/{summary_key}") from e
+    obj = s3_client.get_object(Bucket=bucket, Key=summary_key)
+    body = obj["Body"].read().decode("utf-8")
+    print(f"[Poll] Summary found: s3://{bucket}/{summary_key}")
+    return summary_key, body
 
 
 # --- Local test runner functions (mock + real) ---
@@ -250,7 +388,7 @@ def run_presign_test(use_real=False, real_s3_client=None):
         # If real mode, let presign_handler use the real s3 client
         presign_module.s3_client = real_s3_client
     else:
-        presign_module.s3_client = MockS3Client(INPUT_BUCKET_NAME)
+        presign_module.s3_client = mock_clients(INPUT_BUCKET_NAME, MOCK_AUDIO_KEY)[0]
 
     try:
         presign_result = presign_module.presign_handler(event=presign_event, context={})
@@ -259,42 +397,57 @@ def run_presign_test(use_real=False, real_s3_client=None):
         raise
 
     print("\n--- SIMULATION RESULT (Presign) ---")
-    print(json.dumps(presign_result, ensure_ascii=False, indent=2))
+    print_json(presign_result)
 
 
-def run_s3_flow_test(use_real=False, audio_path=None, invoke_lambda=False, lambda_name=None):
+def run_s3_flow_test(use_real=False, audio_path=None, invoke_lambda=False, lambda_name=None, mock_audio_key=MOCK_AUDIO_KEY):
     if not INPUT_BUCKET_NAME:
         print("ERROR: Please set INPUT_BUCKET_NAME in your .env file before local events.")
         return
 
     # default test key if not uploading real file
-    test_audio_key = "audio/user_recording_123.m4a"
-    transcript_json_key = test_audio_key  # mock transcript path
+    test_audio_key = mock_audio_key
 
     # If real mode and audio_path provided, upload the file to S3 and use that key
     if use_real:
         if not audio_path:
             print("ERROR: REAL_CLOUD mode requires AUDIO_PATH environment variable pointing to a local audio file.")
             return
-        import boto3
-        real_s3 = boto3.client("s3")
+        real_s3 = get_s3()
         # choose a key name (timestamped to avoid collisions)
         timestamp = int(time.time())
         base_name = os.path.basename(audio_path)
         test_audio_key = f"audio/{timestamp}_{base_name}"
-        transcript_json_key = test_audio_key
-        # upload file
-        try:
-            upload_file_to_s3(audio_path, INPUT_BUCKET_NAME, test_audio_key, real_s3)
-        except Exception as e:
-            print(f"Upload failed: {e}")
-            return
+        # upload file; במקביל בונים את ה-lambda client (טעינת מודל + credentials) כדי שה-invoke לא יחכה לזה.
+        # ה-client של S3 כבר "חם" מה-upload עצמו, כך שה-polling שאחריו משתמש בחיבור קיים.
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            upload_future = executor.submit(upload_file_to_s3, audio_path, INPUT_BUCKET_NAME, test_audio_key, real_s3)
+            if invoke_lambda:
+                executor.submit(get_lambda)
+            try:
+                upload_future.result()
+            except Exception as e:
+                print(f"Upload failed: {e}")
+                return
     else:
-        # mock mode: set mocks inside module
-        voice_handler_module.s3_client = MockS3Client(INPUT_BUCKET_NAME)
-        voice_handler_module.transcribe_client = MockTranscribeClient(transcript_json_key)
-        voice_handler_module.genai = mock.MagicMock()
-        voice_handler_module.genai.Client = mock_genai_client_factory()
+        # mock mode: set mocks inside module. ה-handlers בונים את s3_client/transcribe_client ברמת המודול
+        # בזמן import, ולכן החלפת ה-attributes היא מסלול ה-patching היחיד (אין צורך ב-mock.patch("boto3.client")).
+        # כל ההחלפות נאספות ל-patch.multiple אחד סביב קריאת ה-handler, ומשוחזרות ביציאה.
+        s3, transcribe, transcribe_stub = mock_clients(INPUT_BUCKET_NAME, test_audio_key)
+        queue_transcribe_job(transcribe_stub)
+        handler_patches = {"s3_client": s3, "transcribe_client": transcribe,
+                           "INPUT_BUCKET_NAME": INPUT_BUCKET_NAME, "GEMINI_API_KEY": GEMINI_API_KEY}
+        if LOCAL_HANDLER == "handler2_0":
+            # handler2_0 בונה את לקוח Gemini בעצלות (_get_gemini_client) – מזריקים את המופע המוכן
+            handler_patches.update(_gemini_client=MockGeminiClient(api_key=GEMINI_API_KEY),
+                                   _probe_duration_ms=lambda local_path: MOCK_AUDIO_DURATION_MS)
+        else:
+            # stub מינימלי במקום MagicMock: גישה ל-attribute לא צפוי נכשלת ב-AttributeError במקום להחזיר mock נוסף
+            handler_patches["genai"] = types.SimpleNamespace(Client=mock_genai_client_factory())
+
+    audio_size = 123456
+    if use_real and audio_path:
+        audio_size = AUDIO_STAT.st_size if AUDIO_STAT is not None else os.path.getsize(audio_path)
 
     # Build a fake S3 event (used both for local invoke and for invoking Lambda directly)
     test_event = {
@@ -309,7 +462,7 @@ def run_s3_flow_test(use_real=False, audio_path=None, invoke_lambda=False, lambd
                     "s3SchemaVersion": "1.0",
                     "configurationId": "localTest",
                     "bucket": {"name": INPUT_BUCKET_NAME},
-                    "object": {"key": test_audio_key, "size": os.path.getsize(audio_path) if (use_real and audio_path) else 123456}
+                    "object": {"key": test_audio_key, "size": audio_size}
                 }
             }
         ]
@@ -324,10 +477,9 @@ def run_s3_flow_test(use_real=False, audio_path=None, invoke_lambda=False, lambd
 
     # If real and invoke_lambda requested, call Lambda invoke (async)
     if use_real and invoke_lambda:
-        import boto3
-        lambda_client = boto3.client("lambda")
+        lambda_client = get_lambda()
         try:
-            payload = json.dumps(test_event).encode("utf-8")
+            payload = _dumps(test_event)
             print(f"[Lambda Invoke] Invoking {lambda_name} asynchronously...")
             lambda_client.invoke(FunctionName=lambda_name, InvocationType="Event", Payload=payload)
             print("[Lambda Invoke] Invocation sent.")
@@ -336,7 +488,7 @@ def run_s3_flow_test(use_real=False, audio_path=None, invoke_lambda=False, lambd
             return
 
         # After invoking, wait for summary to appear in S3
-        s3_client = boto3.client("s3")
+        s3_client = get_s3()
         try:
             summary_key, summary_body = wait_for_summary_in_s3(INPUT_BUCKET_NAME, test_audio_key, s3_client, timeout=SUMMARY_POLL_TIMEOUT, interval=SUMMARY_POLL_INTERVAL, output_prefix=OUTPUT_PREFIX)
             print("\n--- SUMMARY (from S3) ---")
@@ -348,8 +500,7 @@ def run_s3_flow_test(use_real=False, audio_path=None, invoke_lambda=False, lambd
     elif use_real and not invoke_lambda:
         # Real mode but not invoking Lambda directly: assume S3 trigger will run the deployed Lambda automatically.
         print("[Info] File uploaded to S3. Waiting for deployed S3-triggered Lambda to process and write summary...")
-        import boto3
-        s3_client = boto3.client("s3")
+        s3_client = get_s3()
         try:
             summary_key, summary_body = wait_for_summary_in_s3(INPUT_BUCKET_NAME, test_audio_key, s3_client, timeout=SUMMARY_POLL_TIMEOUT, interval=SUMMARY_POLL_INTERVAL, output_prefix=OUTPUT_PREFIX)
             print("\n--- SUMMARY (from S3) ---")
@@ -361,24 +512,65 @@ def run_s3_flow_test(use_real=False, audio_path=None, invoke_lambda=False, lambd
     else:
         # Mock/local invocation: call the handler directly (no real AWS calls)
         try:
-            result = voice_handler_module.agent_handler(event=test_event, context={})
+            with mock.patch.multiple(voice_handler_module, **handler_patches):
+                result = voice_handler_module.agent_handler(event=test_event, context={})
         except Exception as e:
             print("Handler raised an exception during local run:")
             raise
-        print("\n--- SIMULATION RESULT (S3 flow - mock) ---")
-        print(json.dumps(result, ensure_ascii=False, indent=2))
+        # ה-handler חייב לעבור דרך Transcribe: start + get שנכנסו לתור נצרכו במלואם
+        transcribe_stub.assert_no_pending_responses()
+        print(f"\n--- SIMULATION RESULT (S3 flow - mock, {LOCAL_HANDLER}) ---")
+        print_json(result)
+        return result
+
+
+def _run_mock_flow_for_key(audio_key):
+    """
+    Worker for the MOCK_AUDIO_KEYS sweep: one mock S3-flow simulation in its own process, so every
+    key gets fresh mocks / its own moto backend and patching the handler module cannot race.
+    Returns the captured output so the parent prints each scenario as one block.
+    """
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out), contextlib.ExitStack() as stack:
+        if USE_MOTO:
+            from moto import mock_aws  # test-only dependency
+            stack.enter_context(mock_aws(config=MOTO_CONFIG))
+        run_s3_flow_test(use_real=False, mock_audio_key=audio_key)
+    return out.getvalue()
+
+
+def run_mock_sweep(audio_keys):
+    """Run the mock S3 flow for several object keys in parallel processes (one per CPU at most)."""
+    with ProcessPoolExecutor(max_workers=min(len(audio_keys), os.cpu_count() or 1)) as executor:
+        for audio_key, output in zip(audio_keys, executor.map(_run_mock_flow_for_key, audio_keys)):
+            print(f"\n===== {audio_key} =====")
+            print(output, end="")
 
 
 # --- Main entrypoint ---
-if __name__ == "__main__":
-    # Run presign test (mock or real depending on REAL_CLOUD)
-    if REAL_CLOUD:
-        import boto3
-        validate_real_cloud_config()
-        real_s3_client = boto3.client("s3")
-        run_presign_test(use_real=True, real_s3_client=real_s3_client)
-    else:
-        run_presign_test(use_real=False)
+def main():
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper(), format="%(message)s")
+    with contextlib.ExitStack() as stack:
+        if USE_MOTO and not REAL_CLOUD:
+            from moto import mock_aws  # test-only dependency
+            # בלי reset של ה-session הגלובלי של boto3 – מודלי השירות שנטענו נשארים בזיכרון בין הרצות
+            stack.enter_context(mock_aws(config=MOTO_CONFIG))
+
+        # Run presign test (mock or real depending on REAL_CLOUD)
+        if REAL_CLOUD:
+            validate_real_cloud_config()
+            real_s3_client = get_s3()
+            run_presign_test(use_real=True, real_s3_client=real_s3_client)
+        else:
+            run_presign_test(use_real=False)
+
+        # Run S3 flow test (mock or real); כמה מפתחות ב-MOCK_AUDIO_KEYS רצים במקביל בתהליכים נפרדים
+        if not REAL_CLOUD and len(MOCK_AUDIO_KEYS) > 1:
+            run_mock_sweep(MOCK_AUDIO_KEYS)
+        else:
+            run_s3_flow_test(use_real=REAL_CLOUD, audio_path=AUDIO_PATH, invoke_lambda=INVOKE_LAMBDA, lambda_name=LAMBDA_NAME,
+                             mock_audio_key=MOCK_AUDIO_KEYS[0] if MOCK_AUDIO_KEYS else MOCK_AUDIO_KEY)
+
 
-    # Run S3 flow test (mock or real)
-    run_s3_flow_test(use_real=REAL_CLOUD, audio_path=AUDIO_PATH, invoke_lambda=INVOKE_LAMBDA, lambda_name=LAMBDA_NAME)
+if __name__ == "__main__":
+    main()